@@ -1,14 +1,20 @@
-from flask import Flask, session
+from flask import Flask, session, request, g
 from flask_cors import CORS
 from routes.pdf_routes import pdf_bp
 from routes.question_routes import question_bp 
 from routes.auth_routes import auth_bp
 from routes.course_routes import course_bp
+from routes.job_routes import job_bp
+from routes.metrics_routes import metrics_bp
+from services.metrics import observe_request
+from services.tracing import start_trace, end_trace, parse_traceparent
+from models.migrations import run_migrations
 from config import Config
 from datetime import timedelta
 from flask_session import Session
-import debugpy
+from middleware.sessions import LazyMongoDBSessionInterface
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -19,11 +25,29 @@ app = Flask(__name__)
 
 # Configuration
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
-app.config['SESSION_TYPE'] = 'filesystem'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
 
 # Make the session permanent and set the session lifetime
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1)  # Adjust the session lifetime as needed
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=Config.SESSION_LIFETIME_HOURS)
+
+# Server-side sessions, the cookie only holds the session id
+app.config['SESSION_TYPE'] = Config.SESSION_TYPE
+app.config['SESSION_PERMANENT'] = Config.SESSION_PERMANENT
+app.config['SESSION_USE_SIGNER'] = Config.SESSION_USE_SIGNER
+app.config['SESSION_KEY_PREFIX'] = Config.SESSION_KEY_PREFIX
+# only modified sessions are written, make_session_permanent refreshes the others periodically
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+if Config.SESSION_TYPE == 'mongodb':
+    # on the lazy shared client, nothing connects to Mongo before the workers are forked
+    app.session_interface = LazyMongoDBSessionInterface(app)
+else:
+    if Config.SESSION_TYPE == 'redis':
+        import redis
+        app.config['SESSION_REDIS'] = redis.Redis.from_url(Config.SESSION_REDIS_URL)
+    else:
+        app.config['SESSION_FILE_DIR'] = Config.SESSION_FILE_DIR
+        app.config['SESSION_FILE_THRESHOLD'] = Config.SESSION_FILE_THRESHOLD
+    Session(app)
 
 # Enable CORS with credentials support
 CORS(app, 
@@ -33,6 +57,7 @@ CORS(app,
             "origins": ["http://localhost:3000"],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
             "allow_headers": ["Content-Type", "Authorization"],
+            "expose_headers": ["X-Next-Cursor", "X-Trace-Id"],
             "supports_credentials": True
         }
      })
@@ -42,17 +67,55 @@ app.register_blueprint(pdf_bp)
 app.register_blueprint(question_bp)
 app.register_blueprint(auth_bp)
 app.register_blueprint(course_bp)
+app.register_blueprint(job_bp)
+app.register_blueprint(metrics_bp)
+
+# Indexes and data migrations run once here, not on every import of the models
+if Config.MONGO_MIGRATE_ON_BOOT:
+    run_migrations()
+
 @app.before_request
-def make_session_permanent():
-    """Make session permanent and refresh lifetime on each request."""
-    session.permanent = True  # Make the session permanent
-    session.modified = True   # Refresh session timeout on each request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    trace_id, parent_id = parse_traceparent(request.headers.get('traceparent'))
+    g.trace_root, g.trace_token = start_trace(
+        f"{request.method} {route}", trace_id, parent_id, **{"http.method": request.method, "http.route": route}
+    )
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+@app.after_request
+def record_request_latency(response):
+    """Latency per route, labelled with the URL rule so /api/courses/<course_id> is a single series"""
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe_request(route, request.method, response.status_code, time.perf_counter() - started_at)
+    root = g.get('trace_root')
+    if root is not None:
+        root.set_attribute("http.status_code", response.status_code)
+        response.headers['X-Trace-Id'] = root.trace.trace_id
+    return response
 
-    # debug=True runs the server in development mode with auto-reload
-    # quite weirdly, if it is activated it is not possible to attach the vs-code debugger
-    # so to debug the server it needs to be disabled
-    # app.run(host='0.0.0.0', port=5001, debug=True)
+@app.teardown_request
+def end_request_trace(error):
+    """The trace ends with the request, after the body of a streamed response is sent"""
+    end_trace(g.pop('trace_root', None), g.pop('trace_token', None), f"{type(error).__name__}: {error}" if error else None)
 
+@app.before_request
+def make_session_permanent():
+    """Make session permanent and refresh its lifetime, the session is only rewritten once per refresh interval."""
+    if not session.permanent:
+        session.permanent = True  # Make the session permanent
+    refreshed_at = session.get('refreshed_at')
+    if 'user_id' in session and (refreshed_at is None or time.time() - refreshed_at > Config.SESSION_REFRESH_INTERVAL):
+        session['refreshed_at'] = time.time()  # modifies the session, so it is saved with a new expiry
+
+if __name__ == '__main__':
+    # Development server, production runs gunicorn -c gunicorn.conf.py app:app
+    if Config.DEBUGPY_ENABLED:
+        import debugpy
+        debugpy.listen(("0.0.0.0", Config.DEBUGPY_PORT))
+        # quite weirdly, with the reloader of debug=True it is not possible to attach the vs-code debugger
+        app.run(host='0.0.0.0', port=5001, debug=False)
+    else:
+        app.run(host='0.0.0.0', port=5001, debug=Config.FLASK_DEBUG)
@@ -1,13 +1,146 @@
 import os
+from dotenv import load_dotenv
+
+# Read before the class body, the models take their Mongo settings from here
+load_dotenv()
 
 class Config:
     SECRET_KEY = str(os.getenv('SECRET_KEY', 'default-secret-key'))
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-    SESSION_TYPE = 'filesystem'  # Using filesystem for session storage
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # None uses the default OpenAI endpoint
+    # Server-side sessions, expired ones are removed by a TTL index (mongodb, redis) or pruned (filesystem)
+    SESSION_TYPE = os.getenv('SESSION_TYPE', 'mongodb')  # mongodb, redis or filesystem
     SESSION_FILE_DIR = 'cookies'  # Specify the directory for session files
+    SESSION_FILE_THRESHOLD = int(os.getenv('SESSION_FILE_THRESHOLD', 5000))  # files kept before expired ones are pruned
+    SESSION_MONGODB_COLLECT = 'sessions'
+    SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/3')
     SESSION_PERMANENT = True
     SESSION_USE_SIGNER = True
     SESSION_KEY_PREFIX = 'session:'
-    # Ensure the directory exists or create it
-    os.makedirs(SESSION_FILE_DIR, exist_ok=True)
+    SESSION_LIFETIME_HOURS = int(os.getenv('SESSION_LIFETIME_HOURS', 24))
+    # The session expiry is extended by requests at most once per interval, not on every request
+    SESSION_REFRESH_INTERVAL = int(os.getenv('SESSION_REFRESH_INTERVAL', 3600))
+
+    # Chatbot response cache: in-memory LRU in front of a local SQLite file
+    LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 1024))
+    LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+    LLM_CACHE_DB_PATH = os.getenv('LLM_CACHE_DB_PATH', 'cache/llm_responses.sqlite3')  # empty to disable the persistent tier
+    LLM_CACHE_DB_MAX_ENTRIES = int(os.getenv('LLM_CACHE_DB_MAX_ENTRIES', 100000))
+
+    # Shared OpenAI clients: HTTP connection pool and timeouts
+    LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 100))
+    LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 20))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60))
+    LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+    LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', 120))
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 4))
+
+    # Admission control for chatbot calls, shared by all workers through a file lock (or redis)
+    LLM_RATE_LIMIT_ENABLED = os.getenv('LLM_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    LLM_RATE_LIMIT_BACKEND = os.getenv('LLM_RATE_LIMIT_BACKEND', 'file')  # file, redis or memory
+    LLM_RATE_LIMIT_REDIS_URL = os.getenv('LLM_RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    LLM_RATE_LIMIT_STATE_DIR = os.getenv('LLM_RATE_LIMIT_STATE_DIR', 'cache/rate_limit')
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', 500))
+    LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', 200000))
+    LLM_MAX_CONCURRENT_REQUESTS = int(os.getenv('LLM_MAX_CONCURRENT_REQUESTS', 32))
+    LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT', 60))
+    LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv('LLM_COMPLETION_TOKENS_ESTIMATE', 400))
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5))
+    LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', 20))
+
+    # Rewrite, evaluate and create refinement questions for an answer with a single structured chatbot call
+    COMBINED_EVALUATION = os.getenv('COMBINED_EVALUATION', 'true').lower() == 'true'
+
+    # Background processing of uploaded files
+    # process (a pool of processes started by the web worker), thread (in the web worker, blocks a gevent worker) or celery
+    JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'process')
+    INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 2))
+    # running jobs not updated for longer are failed, e.g. when the process running them was killed
+    JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 900))
+    CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/1')
+    RETRIEVAL_WORKERS = int(os.getenv('RETRIEVAL_WORKERS', 10))  # questions retrieved and reranked concurrently per file
+
+    # Question generation: map_reduce generates questions per section of the document,
+    # whole_document sends the whole document in one prompt and retrieves a reference text for each question
+    QUESTION_GENERATION_MODE = os.getenv('QUESTION_GENERATION_MODE', 'map_reduce')
+    QUESTION_SECTION_MAX_CHARS = int(os.getenv('QUESTION_SECTION_MAX_CHARS', 3000))
+    QUESTION_MAX_SECTIONS = int(os.getenv('QUESTION_MAX_SECTIONS', 12))
+    # Question sets are stored by file content hash and reused for the next uploads of the same file
+    QUESTION_BANK_ENABLED = os.getenv('QUESTION_BANK_ENABLED', 'true').lower() == 'true'
+    QUESTION_BANK_MAX_SETS = int(os.getenv('QUESTION_BANK_MAX_SETS', 5))  # sets kept per file, a random one is served
+
+    # Embeddings of the document chunks, reused when the same material is processed again.
+    # Only QUESTION_GENERATION_MODE=whole_document embeds the documents, map_reduce needs no embeddings
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_DB_PATH = os.getenv('EMBEDDING_CACHE_DB_PATH', 'cache/embeddings.sqlite3')
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 500000))
+
+    # Write-behind ranking awards: aggregated in memory and written in bulk by a background thread
+    RANKING_WRITE_BEHIND = os.getenv('RANKING_WRITE_BEHIND', 'false').lower() == 'true'
+    RANKING_FLUSH_INTERVAL = float(os.getenv('RANKING_FLUSH_INTERVAL', 2))
+    RANKING_FLUSH_MAX_PENDING = int(os.getenv('RANKING_FLUSH_MAX_PENDING', 1000))  # users pending before an early flush
+    RANKING_BUFFER_DURABILITY = os.getenv('RANKING_BUFFER_DURABILITY', 'journal')  # none, journal or fsync
+    RANKING_JOURNAL_DIR = os.getenv('RANKING_JOURNAL_DIR', 'cache/ranking_journal')
+    # MongoDB: one client per process, created on first use
+    MONGODB_URI = os.getenv('MONGODB_URI')
+    MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'studymate')
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))  # wait for a free connection
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000))
+    MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+    MONGO_SLOW_QUERY_MS = float(os.getenv('MONGO_SLOW_QUERY_MS', 200))
+    # Create indexes and apply data migrations at startup, otherwise run `python -m models.migrations`
+    MONGO_MIGRATE_ON_BOOT = os.getenv('MONGO_MIGRATE_ON_BOOT', 'true').lower() == 'true'
+    # a migration claimed for longer was interrupted (its process was killed), the next boot runs it again
+    MONGO_MIGRATION_STALE_SECONDS = int(os.getenv('MONGO_MIGRATION_STALE_SECONDS', 1800))
+    # Quizzes in progress, shared by all workers: mongo, redis or memory (single process only)
+    QUIZ_SESSION_BACKEND = os.getenv('QUIZ_SESSION_BACKEND', 'mongo')
+    QUIZ_SESSION_REDIS_URL = os.getenv('QUIZ_SESSION_REDIS_URL', 'redis://localhost:6379/2')
+    QUIZ_SESSION_TTL = int(os.getenv('QUIZ_SESSION_TTL', 6 * 3600))  # seconds since the last answer
+    # memory backend: bounded cache of the process, evicted quizzes are spilled to mongo, redis or none (lost)
+    QUIZ_SESSION_CACHE_MAX_ENTRIES = int(os.getenv('QUIZ_SESSION_CACHE_MAX_ENTRIES', 2000))
+    QUIZ_SESSION_CACHE_MAX_BYTES = int(os.getenv('QUIZ_SESSION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    QUIZ_SESSION_CACHE_IDLE_SECONDS = int(os.getenv('QUIZ_SESSION_CACHE_IDLE_SECONDS', 1800))
+    QUIZ_SESSION_SPILL_BACKEND = os.getenv('QUIZ_SESSION_SPILL_BACKEND', 'mongo')
+    # Production server (gunicorn.conf.py): gevent workers serve many students each while they wait on OpenAI and Mongo
+    SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5001')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.cpu_count() or 1))
+    SERVER_WORKER_CLASS = os.getenv('SERVER_WORKER_CLASS', 'gevent')  # gevent, gthread or sync
+    SERVER_WORKER_CONNECTIONS = int(os.getenv('SERVER_WORKER_CONNECTIONS', 200))  # concurrent requests per gevent worker
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 8))  # threads per gthread worker
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 120))  # a worker silent for longer is restarted
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))
+    SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', 5))
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 0))  # restart workers after N requests, 0 never
+    # Development server (python app.py) and remote debugging, debugpy is only imported when enabled
+    FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    DEBUGPY_ENABLED = os.getenv('DEBUGPY_ENABLED', 'false').lower() == 'true'
+    DEBUGPY_PORT = int(os.getenv('DEBUGPY_PORT', 5679))
+
+    # Prometheus metrics, see services/metrics.py: /metrics requires this bearer token,
+    # without one it is only served to loopback and private network addresses (e.g. Prometheus in the docker network)
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+    # Request tracing, see services/tracing.py
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'jsonl')  # jsonl, otlp or none
+    TRACE_FILE = os.getenv('TRACE_FILE', 'traces/traces.jsonl')
+    TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', 50 * 1024 * 1024))  # rotated beyond this size
+    TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', 3))  # rotated files kept, traces.jsonl.1 is the newest
+    TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'questudy-backend')
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))  # share of the traces exported
+    TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 3000))  # slower traces are always exported
+    # thresholds of the traces expected to be slow, "<trace name>=<ms>" separated by commas: chatbot calls take seconds
+    TRACE_SLOW_MS_BY_NAME = os.getenv(
+        'TRACE_SLOW_MS_BY_NAME',
+        'POST /api/submit_answer=30000,POST /api/submit_answer/stream=60000,POST /api/rewrite_answer=20000,'
+        'GET /api/get_question=30000,ingestion job=600000'
+    )
+    TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', 2000))  # per trace
+    TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', 1000))  # traces waiting to be exported
     # Add other configurations as needed
@@ -0,0 +1,46 @@
+"""
+Production server settings, read from Config:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+With the gevent worker class, the standard library is patched before the app is loaded in each
+worker, so a worker serves SERVER_WORKER_CONNECTIONS requests concurrently while they wait on
+OpenAI and Mongo. The app is loaded after the fork, so no client or pool is shared between workers.
+"""
+import os
+
+if os.getenv('SERVER_WORKER_CLASS', 'gevent') == 'gevent':
+    # before anything imports ssl or selectors, the gevent worker patches too late for them
+    from gevent import monkey
+    monkey.patch_all()
+
+from config import Config
+
+bind = Config.SERVER_BIND
+workers = Config.SERVER_WORKERS
+worker_class = Config.SERVER_WORKER_CLASS
+worker_connections = Config.SERVER_WORKER_CONNECTIONS
+threads = Config.SERVER_THREADS
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = Config.SERVER_KEEPALIVE
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS // 10
+preload_app = False
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # metrics samples of the workers of a previous run must not be aggregated with the new ones
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,286 @@
+"""
+Deterministic OpenAI-compatible stand-in for load tests.
+
+Serves /v1/chat/completions (plain, streamed and json_schema responses) and /v1/embeddings
+with canned answers shaped like the backend prompts, after a configurable latency.
+
+    python loadtest/fake_llm_server.py --port 8090 --latency-dist lognormal --latency-mean 0.8
+
+Point the backend at it with OPENAI_BASE_URL=http://localhost:8090/v1 and any OPENAI_API_KEY.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+class LatencyModel:
+    """Samples response latencies (in seconds) from a fixed, uniform or lognormal distribution."""
+
+    def __init__(self, distribution, mean, spread, seed):
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.distribution == "fixed":
+                return self.mean
+            if self.distribution == "uniform":
+                return max(0.0, self._random.uniform(self.mean - self.spread, self.mean + self.spread))
+            if self.mean <= 0:
+                return 0.0
+            # lognormal with the requested mean, spread is the sigma of the underlying normal
+            mu = math.log(self.mean) - self.spread ** 2 / 2
+            return self._random.lognormvariate(mu, self.spread)
+
+
+def request_random(body):
+    """Random generator seeded by the request so identical requests get identical answers."""
+    return random.Random(hashlib.sha256(body).digest())
+
+
+def extract_tag(text, tag):
+    match = re.search(rf"<{tag}>(.*?)</{tag}>", text, re.IGNORECASE | re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def canned_completion(messages, response_format, rng):
+    """Answer in the format the backend expects for each of its prompts."""
+    system_prompt = messages[0]["content"] if messages else ""
+    user_prompt = messages[-1]["content"] if messages else ""
+
+    if response_format and response_format.get("type") == "json_schema":
+        score = rng.choice(["perfect", "correct", "partial", "incorrect"])
+        failed = score in ("partial", "incorrect")
+        return json.dumps({
+            "normalized_answer": extract_tag(user_prompt, "ANSWER") or "An answer.",
+            "score": score,
+            "feedback": "<ul><li>Clarify the key concept.</li></ul>" if failed else "",
+            "refinement_questions": [
+                "Which part of the concept did you leave out?",
+                "How does it relate to the rest of the text?",
+            ] if failed else [],
+        })
+
+    if "create follow-up questions" in system_prompt:
+        return "\n".join(
+            f"Simpler question {i + 1} about the same concept? | Expected answer {i + 1}"
+            for i in range(rng.randint(1, 2))
+        )
+
+    match = re.search(r"generate (\d+) questions", system_prompt)
+    if match:
+        count = int(match.group(1))
+        return "\n".join(f"What is key concept {i + 1} of the text? | Concept {i + 1}" for i in range(count))
+
+    if "Enhance the clarity" in system_prompt:
+        return extract_tag(user_prompt, "answer") or "An answer."
+
+    if "Evaluate the user's performance" in user_prompt:
+        return "<h3>Session summary</h3><ul><li>Good grasp of the main ideas.</li><li>Review the details.</li></ul>"
+
+    if "REFERENCE_TEXT" in system_prompt:
+        verdict = rng.choice(["Perfect", "Correct", "Partially correct", "Wrong"])
+        if verdict in ("Perfect", "Correct"):
+            return verdict
+        return f"{verdict}\n<ul><li>Clarify the key concept.</li></ul>"
+
+    if "USER'S ANSWER" in user_prompt:
+        return "The reference text explains the concept in more detail: review its main definition."
+
+    # RankGPT reranking: passages are labelled [1], [2], ...
+    identifiers = sorted({int(i) for m in messages for i in re.findall(r"\[(\d+)\]", str(m.get("content", "")))})
+    if identifiers:
+        return " > ".join(f"[{i}]" for i in identifiers)
+
+    return "OK"
+
+
+def fake_embedding(text):
+    """Deterministic unit vector derived from the text hash."""
+    seed = hashlib.sha256(str(text).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeLLM/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            return self._send_json(400, {"error": {"message": "invalid JSON body"}})
+
+        if self.server.error_rate and self.server.error_random() < self.server.error_rate:
+            return self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": "1"},
+            )
+
+        time.sleep(self.server.latency.sample())
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            return self._chat_completion(payload, body)
+        if path.endswith("/embeddings"):
+            return self._embeddings(payload)
+        return self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _chat_completion(self, payload, body):
+        model = payload.get("model", "gpt-4o-mini")
+        messages = payload.get("messages", [])
+        content = canned_completion(messages, payload.get("response_format"), request_random(body))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        completion_tokens = len(content.split())
+
+        if not payload.get("stream"):
+            return self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def write_chunk(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        write_chunk({"role": "assistant", "content": ""})
+        for token in re.findall(r"\S+\s*", content):
+            time.sleep(self.server.token_delay)
+            write_chunk({"content": token})
+        write_chunk({}, finish_reason="stop")
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+            self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, payload):
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for index, text in enumerate(inputs):
+            embedding = fake_embedding(text)
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{len(embedding)}f", *embedding)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(str(text).split()) for text in inputs)
+        return self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+def make_server(host, port, latency, token_delay=0.0, error_rate=0.0, seed=0, verbose=False):
+    server = ThreadingHTTPServer((host, port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_delay = token_delay
+    server.error_rate = error_rate
+    server.error_random = random.Random(seed + 1).random
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.8, help="mean response latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="half width for uniform, sigma for lognormal")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="delay between streamed tokens in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    latency = LatencyModel(args.latency_dist, args.latency_mean, args.latency_spread, args.seed)
+    server = make_server(args.host, args.port, latency, args.token_delay, args.error_rate, args.seed, args.verbose)
+    print(f"Fake LLM server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Load test for the quiz flow.
+
+Simulates N students who each sign up, enroll in a course, upload a PDF, answer questions until the
+quiz is finished and claim the completion points, then reports latency percentiles and throughput per route.
+
+    python loadtest/load_test.py --base-url http://localhost:5001 --students 20 --questions 3
+"""
+import argparse
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ANSWERS = [
+    "It is the main concept described in the text.",
+    "I think it is related to the first definition.",
+    "No idea",
+    "The process described converts the input into the output step by step.",
+]
+
+
+def build_pdf(pages):
+    """Build a small valid PDF with one line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = f"BT /F1 12 Tf 72 720 Td ({escaped}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode("latin-1")
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    return pdf
+
+
+def sample_pdf(page_count):
+    return build_pdf([
+        f"Lecture page {i + 1}: concept {i + 1} is defined as the transformation of an input into an output "
+        f"through {i + 2} successive steps, each step refining the previous result."
+        for i in range(page_count)
+    ])
+
+
+class Recorder:
+    """Thread-safe latency and error recorder, grouped by route."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(values)))
+    return values[rank - 1]
+
+
+class Student:
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.timeout = timeout
+        self.http = requests.Session()
+
+    def call(self, method, route, label=None, **kwargs):
+        """Send a request and record its latency under label (the route template) or the route itself."""
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.http.request(method, self.base_url + route, timeout=self.timeout, **kwargs)
+            if kwargs.get("stream"):
+                # streamed responses are timed until their last event
+                response._content = response.raw.read()
+            ok = response.status_code < 400
+            return response
+        finally:
+            self.recorder.record(label or route, time.perf_counter() - start, ok)
+
+    def sign_up(self, email, password):
+        response = self.call("POST", "/api/auth/signup", json={"email": email, "password": password, "name": email.split("@")[0]})
+        if response.status_code != 201:
+            self.call("POST", "/api/auth/login", json={"email": email, "password": password})
+
+    def wait_for_job(self, job_id, poll_interval=0.2):
+        """Poll an ingestion job until it finishes, its total duration is recorded as "job: ingestion"."""
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            while True:
+                response = self.call("GET", f"/api/jobs/{job_id}", label="/api/jobs/<job_id>")
+                if response.status_code >= 400:
+                    return False
+                status = response.json()["status"]
+                if status in ("done", "failed"):
+                    return status == "done"
+                time.sleep(poll_interval)
+        finally:
+            self.recorder.record("job: ingestion", time.perf_counter() - start, status == "done")
+
+    def submit_answer(self, question, answer, stream):
+        """Submit an answer and return the evaluation result."""
+        payload = {"question": question, "answer": answer}
+        if not stream:
+            response = self.call("POST", "/api/submit_answer", json=payload)
+            return response.json() if response.status_code < 400 else None
+
+        response = self.call("POST", "/api/submit_answer/stream", json=payload, stream=True)
+        if response.status_code >= 400:
+            return None
+        event = None
+        for line in response.text.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "result":
+                return json.loads(line[len("data: "):])
+        return None
+
+    def run_quiz(self, course_id, pdf, question_count, max_answers, rng, stream=False):
+        self.call("POST", f"/api/courses/{course_id}/enroll", label="/api/courses/<course_id>/enroll")
+        self.call("POST", "/api/set_current_course", json={"courseId": course_id})
+
+        response = self.call(
+            "POST",
+            "/api/upload_process_pdf",
+            files={"file": ("lecture.pdf", pdf, "application/pdf")},
+            data={"questionCount": str(question_count)},
+        )
+        if response.status_code >= 400 or not self.wait_for_job(response.json()["job_id"]):
+            return False
+
+        score = 0
+        for _ in range(max_answers):
+            response = self.call("GET", "/api/get_question")
+            if response.status_code >= 400:
+                return False
+            question = response.json()
+            if "chat_evaluation" in question:
+                break
+            result = self.submit_answer(question.get("question"), rng.choice(ANSWERS), stream)
+            if result is None:
+                return False
+            if result.get("score") in ("correct", "perfect"):
+                score += 1
+
+        response = self.call("POST", "/api/award_quiz_completion", json={"score": score})
+        return response.status_code < 400
+
+
+def run(args):
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    pdf = sample_pdf(args.pages)
+
+    # a single course shared by every simulated student
+    owner = Student(args.base_url, Recorder(), args.timeout)
+    owner.sign_up(f"loadtest-{run_id}-owner@example.com", "loadtest-password")
+    response = owner.call("POST", "/api/courses", json={"code": f"LT-{run_id}", "title": "Load test", "level": "Bachelor"})
+    response.raise_for_status()
+    course_id = response.json()["course_id"]
+
+    def simulate(index):
+        rng = random.Random(args.seed + index)
+        time.sleep(rng.uniform(0, args.ramp_up))
+        student = Student(args.base_url, recorder, args.timeout)
+        try:
+            student.sign_up(f"loadtest-{run_id}-{index}@example.com", "loadtest-password")
+            return student.run_quiz(course_id, pdf, args.questions, args.max_answers, rng, args.stream)
+        except requests.RequestException as e:
+            print(f"Student {index} failed: {str(e)}")
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.students) as executor:
+        results = list(executor.map(simulate, range(args.students)))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{sum(results)}/{len(results)} quizzes completed in {elapsed:.1f}s\n")
+    header = f"{'route':<40} {'count':>6} {'errors':>6} {'req/s':>7} {'mean':>7} {'p50':>7} {'p95':>7} {'p99':>7}"
+    print(header)
+    print("-" * len(header))
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        print(
+            f"{route:<40} {len(values):>6} {recorder.errors[route]:>6} {len(values) / elapsed:>7.2f} "
+            f"{statistics.mean(values):>7.3f} {percentile(values, 0.50):>7.3f} "
+            f"{percentile(values, 0.95):>7.3f} {percentile(values, 0.99):>7.3f}"
+        )
+    print("\nlatencies in seconds")
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5001")
+    parser.add_argument("--students", type=int, default=10)
+    parser.add_argument("--questions", type=int, default=3, help="questions generated per upload")
+    parser.add_argument("--pages", type=int, default=5, help="pages of the generated PDF")
+    parser.add_argument("--max-answers", type=int, default=30, help="safety limit of answers per quiz")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="students start uniformly within this many seconds")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true", help="submit answers to the streaming endpoint")
+    args = parser.parse_args()
+    raise SystemExit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Run the backend against the fake LLM server, with a local mongod or an in-memory Mongo stand-in.
+
+    python loadtest/run_backend.py --llm-url http://localhost:8090/v1              # in-memory Mongo (mongomock)
+    python loadtest/run_backend.py --llm-url http://localhost:8090/v1 --mongodb-uri mongodb://localhost:27017
+    python loadtest/run_backend.py --server gunicorn                               # production server (gunicorn.conf.py)
+
+Must be started from the backend directory.
+"""
+import argparse
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-url", default="http://localhost:8090/v1", help="base URL of the fake LLM server")
+    parser.add_argument("--mongodb-uri", default=None, help="local mongod URI, in-memory Mongo if omitted")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--server", choices=["dev", "gunicorn"], default="dev", help="Flask dev server or gunicorn")
+    parser.add_argument("--workers", type=int, default=None, help="gunicorn workers, 1 with the in-memory Mongo")
+    args = parser.parse_args()
+
+    if args.server == "gunicorn" and os.getenv("SERVER_WORKER_CLASS", "gevent") == "gevent":
+        # like gunicorn.conf.py, before mongomock and pymongo import ssl
+        from gevent import monkey
+        monkey.patch_all()
+
+    # must be set before the backend modules read their configuration
+    os.environ["OPENAI_BASE_URL"] = args.llm_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    os.environ["LLM_CACHE_ENABLED"] = os.getenv("LLM_CACHE_ENABLED", "false")
+
+    if args.mongodb_uri:
+        os.environ["MONGODB_URI"] = args.mongodb_uri
+    else:
+        import mongomock
+        import mongomock.gridfs
+        import pymongo
+
+        mongomock.gridfs.enable_gridfs_integration()
+
+        # every MongoClient shares the same in-memory server
+        server = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *a, **kw: server
+        os.environ["MONGODB_URI"] = "mongodb://in-memory"
+        # Flask-Session only accepts a real MongoClient
+        os.environ.setdefault("SESSION_TYPE", "filesystem")
+        # the in-memory database is not shared with other processes, jobs run in threads of the backend
+        os.environ.setdefault("JOB_QUEUE_BACKEND", "thread")
+
+    sys.path.insert(0, os.getcwd())
+    if args.server == "gunicorn":
+        # the in-memory Mongo is not shared between processes
+        workers = args.workers or (1 if not args.mongodb_uri else None)
+        run_gunicorn(args.port, workers)
+        return
+
+    from app import app
+
+    app.run(host="0.0.0.0", port=args.port, debug=False, threaded=True)
+
+
+def run_gunicorn(port, workers):
+    from gunicorn.app.base import Application
+
+    class Server(Application):
+        def init(self, parser, opts, args):
+            pass
+
+        def load_config(self):
+            self.load_config_from_file("gunicorn.conf.py")
+            self.cfg.set("bind", f"0.0.0.0:{port}")
+            if workers:
+                self.cfg.set("workers", workers)
+
+        def load(self):
+            # imported in the worker, after gevent patched it
+            from app import app
+            return app
+
+    Server().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Startup benchmark: import time and memory of the backend modules, each imported in a fresh interpreter.
+
+    python loadtest/startup_benchmark.py                   # app and every route module
+    python loadtest/startup_benchmark.py --repeat 5 --json startup.json
+    python loadtest/startup_benchmark.py --max-seconds 3   # exit 1 if a module takes longer to import
+
+The heavy column lists the heavy packages (llama_index...) loaded by the import. The web process must
+not load them, they are loaded by the ingestion jobs. Must be started from the backend directory.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "app",
+    "routes.auth_routes",
+    "routes.course_routes",
+    "routes.job_routes",
+    "routes.pdf_routes",
+    "routes.question_routes",
+    "services.process_and_chunk_pdf.process_pdf_workflow",
+]
+
+# packages that must only be loaded by the processes running ingestion jobs
+HEAVY_PACKAGES = ["llama_index", "nltk", "tiktoken", "pypdf"]
+
+PROBE = """
+import importlib, json, sys, time
+
+def rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * {page_size}
+
+start_rss = rss()
+start = time.perf_counter()
+importlib.import_module({module!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": (rss() - start_rss) / 1024 / 1024,
+    "modules": len(sys.modules),
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(module, env):
+    probe = PROBE.format(module=module, heavy=HEAVY_PACKAGES, page_size=os.sysconf("SC_PAGE_SIZE"))
+    completed = subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{completed.stderr}")
+    # the last line, modules may print while they are imported
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=MODULES, help="modules to import")
+    parser.add_argument("--repeat", type=int, default=3, help="imports per module, the median is reported")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail if a module takes longer to import")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.getcwd()
+    # only the imports are measured: no migrations and no Mongo round trip for the sessions
+    env.setdefault("MONGO_MIGRATE_ON_BOOT", "false")
+    env.setdefault("SESSION_TYPE", "filesystem")
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+
+    results = {}
+    print(f"{'module':<55} {'seconds':>8} {'rss MB':>8} {'modules':>8}  heavy")
+    print("-" * 100)
+    for module in args.modules:
+        runs = [measure(module, env) for _ in range(args.repeat)]
+        result = {
+            "seconds": statistics.median(run["seconds"] for run in runs),
+            "rss_mb": statistics.median(run["rss_mb"] for run in runs),
+            "modules": runs[-1]["modules"],
+            "heavy": runs[-1]["heavy"],
+        }
+        results[module] = result
+        print(
+            f"{module:<55} {result['seconds']:>8.2f} {result['rss_mb']:>8.1f} {result['modules']:>8}  "
+            f"{', '.join(result['heavy']) or '-'}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.max_seconds is not None:
+        slow = [module for module, result in results.items() if result["seconds"] > args.max_seconds]
+        if slow:
+            print(f"\nslower than {args.max_seconds}s to import: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
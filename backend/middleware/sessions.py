@@ -0,0 +1,25 @@
+from flask_session.base import ServerSideSessionInterface
+from flask_session.mongodb import MongoDBSessionInterface
+
+from config import Config
+from models.login_session import login_sessions
+
+
+class LazyMongoDBSessionInterface(MongoDBSessionInterface):
+    """
+    Flask-Session's MongoDB interface on the shared client of models.db. Its own constructor connects
+    and creates the TTL index at import, in the gunicorn master, here the client connects on the first
+    request of a worker and the index is created by the migrations (LoginSession.create_indexes).
+    """
+
+    def __init__(self, app):
+        self.client = None
+        self.store = login_sessions
+        self.use_deprecated_method = False
+        ServerSideSessionInterface.__init__(
+            self,
+            app,
+            key_prefix=Config.SESSION_KEY_PREFIX,
+            use_signer=Config.SESSION_USE_SIGNER,
+            permanent=Config.SESSION_PERMANENT,
+        )
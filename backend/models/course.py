@@ -1,19 +1,65 @@
 from datetime import datetime
-from pymongo import MongoClient
-from bson.binary import Binary
-import os
-from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, TEXT
+from gridfs import GridFS
 import uuid
 import re
+import unicodedata
+import base64
+import json
+from models.db import LazyCollection, get_db
 
-load_dotenv()
+courses = LazyCollection("courses")
 
-mongodb_uri = os.getenv('MONGODB_URI')
-client = MongoClient(mongodb_uri)
-db = client.studymate
-courses = db.courses
+def get_course_files():
+    """File contents are stored in GridFS, the course document only keeps their metadata"""
+    return GridFS(get_db(), collection="course_files")
+
+def encode_cursor(position):
+    """Opaque pagination token for the position of the last returned item"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(token, *keys):
+    """Raises ValueError if the token is invalid or lacks one of the keys"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict) or any(key not in position for key in keys):
+        raise ValueError("Invalid cursor")
+    return position
+
+def normalize_search_text(text):
+    """Lowercase, strip accents and replace punctuation with spaces"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+def build_search_terms(code, title):
+    """Words of the code and title, and the code without spaces so "cs1" completes "CS 101" """
+    normalized_code = normalize_search_text(code)
+    terms = set(normalized_code.split()) | set(normalize_search_text(title).split())
+    terms.add(normalized_code.replace(" ", ""))
+    terms.discard("")
+    return sorted(terms)
+
+# Fields returned by the search, is_enrolled is added by Course.set_is_enrolled
+SEARCH_RESULT_FIELDS = {"_id": 1, "code": 1, "title": 1, "level": 1, "creator_id": 1}
 
 class Course:
+    @staticmethod
+    def create_indexes():
+        # Word search uses the text index, autocomplete uses prefixes of the normalized search terms
+        courses.create_index(
+            [("code", TEXT), ("title", TEXT)],
+            weights={"code": 10, "title": 5},
+            name="course_text"
+        )
+        courses.create_index([("search_terms", ASCENDING)])
+        # Dashboard listing: each branch of the $or is read in (created_at, _id) order from its own index
+        courses.create_index([("enrolled_users", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+        courses.create_index([("creator_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+        courses.create_index([("created_at", DESCENDING)])
+
     def __init__(self, code, title, level, creator_id):
         self.code = code
         self.title = title
@@ -22,7 +68,6 @@ class Course:
         self.enrolled_users = [creator_id]  # Creator is automatically enrolled
         self.files = []
         self.created_at = datetime.utcnow()
-        self.rankings = []  # Add rankings field
 
     @staticmethod
     def create_course(code, title, level, creator_id):
@@ -33,52 +78,87 @@ class Course:
             "level": level,
             "creator_id": creator_id,
             "enrolled_users": [creator_id],
+            "search_terms": build_search_terms(code, title),
             "files": [],
-            "created_at": datetime.utcnow(),
-            "rankings": []  # Initialize rankings
+            "created_at": datetime.utcnow()
         }
         result = courses.insert_one(course)
         return course["_id"]
 
     @staticmethod
-    def get_user_courses(user_id):
-        """Get basic course info for dashboard"""
+    def get_user_courses(user_id, limit=50, cursor=None):
+        """
+        Get basic course info for dashboard, newest first, one page at a time.
+        Returns (courses, next_cursor), next_cursor is None on the last page.
+        """
         try:
-            cursor = courses.find(
-                {
-                    "$or": [
-                        {"enrolled_users": user_id},
-                        {"creator_id": user_id}
-                    ]
-                },
+            query = {
+                "$or": [
+                    {"enrolled_users": user_id},
+                    {"creator_id": user_id}
+                ]
+            }
+            if cursor:
+                position = decode_cursor(cursor, "created_at", "id")
+                created_at = datetime.fromisoformat(str(position["created_at"]))
+                # keyset: the courses after the last one returned, in (created_at, _id) order
+                query = {"$and": [query, {"$or": [
+                    {"created_at": {"$lt": created_at}},
+                    {"created_at": created_at, "_id": {"$lt": position["id"]}}
+                ]}]}
+
+            page = list(courses.find(
+                query,
                 {
                     "_id": 1,
                     "code": 1,
                     "title": 1,
                     "level": 1,
                     "creator_id": 1,
-                    "enrolled_users": 1,
                     "created_at": 1
                 }
-            )
-            
+            ).sort([("created_at", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1))
+
+            next_cursor = None
+            if len(page) > limit:
+                page = page[:limit]
+                next_cursor = encode_cursor({"created_at": page[-1]["created_at"].isoformat(), "id": page[-1]["_id"]})
+            Course.set_is_enrolled(page, user_id)
+
             course_list = []
-            for course in cursor:
+            for course in page:
                 course_dict = {
                     "_id": course["_id"],
                     "code": course["code"],
                     "title": course["title"],
                     "level": course["level"],
                     "creator_id": course["creator_id"],
-                    "enrolled_users": course.get("enrolled_users", []),
+                    "is_enrolled": course["is_enrolled"],
                     "created_at": course["created_at"].isoformat()
                 }
                 course_list.append(course_dict)
             
-            return course_list
+            return course_list, next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             print(f"Error getting user courses: {str(e)}")
-            return []
+            return [], None
+
+    @staticmethod
+    def set_is_enrolled(results, user_id):
+        """
+        Set is_enrolled on every result, whether the user is enrolled in the course,
+        the list of enrolled users of each course is never loaded
+        """
+        enrolled = {
+            course["_id"] for course in courses.find(
+                {"_id": {"$in": [result["_id"] for result in results]}, "enrolled_users": user_id},
+                {"_id": 1}
+            )
+        }
+        for result in results:
+            result["is_enrolled"] = result["_id"] in enrolled
 
     @staticmethod
     def get_course_details(course_id):
@@ -100,37 +180,125 @@ class Course:
             return None
 
     @staticmethod
-    def search_courses(query):
+    def search_courses(query, user_id, limit=20, cursor=None):
+        """
+        Search courses by words (text index, ranked by relevance), followed by the courses
+        having a search term starting with each word of the query (autocomplete).
+        Returns (courses, next_cursor), next_cursor is None on the last page.
+        """
         try:
-            # Create a case-insensitive regex pattern
-            pattern = re.compile(query, re.IGNORECASE)
-            
-            # Search in both code and title fields
-            cursor = courses.find({
-                "$or": [
-                    {"code": {"$regex": pattern}},
-                    {"title": {"$regex": pattern}}
-                ]
-            }, {
-                "_id": 1,
-                "code": 1,
-                "title": 1,
-                "level": 1,
-                "creator_id": 1,
-                "enrolled_users": 1
-            })
-            
-            # Ensure enrolled_users exists in each result
-            results = list(cursor)
-            for result in results:
-                if 'enrolled_users' not in result:
-                    result['enrolled_users'] = []
-                
-            return results
+            words = sorted(normalize_search_text(query).split(), key=len, reverse=True)
+            if not words:
+                return [], None
+            text_query = {"$search": " ".join(words)}
+            position = decode_cursor(cursor, "phase", "id") if cursor else {"phase": "text"}
+            if position["phase"] not in ("text", "prefix"):
+                raise ValueError("Invalid cursor")
+            if cursor and position["phase"] == "text" and "score" not in position:
+                raise ValueError("Invalid cursor")
+
+            results = []
+            if position["phase"] == "text":
+                page = Course.text_search_page(text_query, position, limit + 1)
+                if len(page) > limit:
+                    results = page[:limit]
+                    last = results[-1]
+                    next_cursor = encode_cursor({"phase": "text", "score": last["score"], "id": last["_id"]})
+                    return Course.format_search_results(results, user_id), next_cursor
+                results = page
+                position = {"phase": "prefix", "id": None}
+
+            # one more than the remaining slots to know if there is a next page
+            remaining = limit - len(results)
+            page = Course.prefix_search_page(words, text_query, position.get("id"), remaining + 1)
+            results.extend(page[:remaining])
+            next_cursor = None
+            if len(page) > remaining:
+                last_id = page[remaining - 1]["_id"] if remaining else position.get("id")
+                next_cursor = encode_cursor({"phase": "prefix", "id": last_id})
+            return Course.format_search_results(results, user_id), next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             print(f"Error searching courses: {str(e)}")
+            return [], None
+
+    @staticmethod
+    def text_search_page(text_query, position, count):
+        """Text matches after the position, in (score desc, _id) order"""
+        pipeline = [
+            {"$match": {"$text": text_query}},
+            {"$addFields": {"score": {"$meta": "textScore"}}}
+        ]
+        if "score" in position:
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": position["score"]}},
+                {"score": position["score"], "_id": {"$gt": position["id"]}}
+            ]}})
+        pipeline += [
+            {"$sort": {"score": -1, "_id": 1}},
+            {"$limit": count},
+            {"$project": {**SEARCH_RESULT_FIELDS, "score": 1}}
+        ]
+        try:
+            return list(courses.aggregate(pipeline))
+        except Exception as e:
+            print(f"Error in course text search: {str(e)}")
             return []
 
+    @staticmethod
+    def prefix_search_page(words, text_query, after_id, count):
+        """Prefix matches that are not text matches (already returned) after after_id, in _id order"""
+        # the regexes are anchored and escaped, the longest word is matched with the index
+        prefix_filter = [{"search_terms": re.compile("^" + re.escape(word))} for word in words]
+        found = []
+        while len(found) < count:
+            query = {"$and": prefix_filter}
+            if after_id is not None:
+                query["_id"] = {"$gt": after_id}
+            batch = list(courses.find(query, SEARCH_RESULT_FIELDS).sort("_id", ASCENDING).limit(count))
+            if not batch:
+                break
+            text_matches = Course.text_matches(text_query, [course["_id"] for course in batch])
+            found.extend(course for course in batch if course["_id"] not in text_matches)
+            after_id = batch[-1]["_id"]
+            if len(batch) < count:
+                break
+        return found[:count]
+
+    @staticmethod
+    def text_matches(text_query, course_ids):
+        try:
+            return {
+                course["_id"] for course in courses.find(
+                    {"$text": text_query, "_id": {"$in": course_ids}}, {"_id": 1}
+                )
+            }
+        except Exception as e:
+            print(f"Error in course text search: {str(e)}")
+            return set()
+
+    @staticmethod
+    def format_search_results(results, user_id):
+        for result in results:
+            result.pop('score', None)
+        Course.set_is_enrolled(results, user_id)
+        return results
+
+    @staticmethod
+    def add_missing_search_terms():
+        """Set the search terms of the courses created before they existed"""
+        try:
+            for course in courses.find({"search_terms": {"$exists": False}}, {"code": 1, "title": 1}):
+                courses.update_one(
+                    {"_id": course["_id"]},
+                    {"$set": {"search_terms": build_search_terms(course.get("code", ""), course.get("title", ""))}}
+                )
+            return True
+        except Exception as e:
+            print(f"Error adding search terms: {str(e)}")
+            return False
+
     @staticmethod
     def enroll_user(course_id, user_id):
         try:
@@ -146,7 +314,7 @@ class Course:
     @staticmethod
     def unenroll_user(course_id, user_id):
         try:
-            course = courses.find_one({"_id": course_id})
+            course = courses.find_one({"_id": course_id}, {"creator_id": 1})
             if course and course['creator_id'] != user_id:
                 result = courses.update_one(
                     {"_id": float(course_id)},
@@ -161,19 +329,26 @@ class Course:
     @staticmethod
     def is_course_creator(course_id, user_id):
         try:
-            course = courses.find_one({"_id": course_id})
+            course = courses.find_one({"_id": course_id}, {"creator_id": 1})
             return course and course['creator_id'] == user_id
         except Exception as e:
             print(f"Error checking creator status: {str(e)}")
             return False
 
     @staticmethod
-    def add_file(course_id, file_data, filename, content_type):
+    def add_file(course_id, file_stream, filename, content_type):
+        """Store a file read in chunks from file_stream, the course only references it"""
         try:
+            file_id = str(uuid.uuid4())
+            get_course_files().put(
+                file_stream,
+                _id=file_id,
+                filename=filename,
+                metadata={"course_id": course_id, "content_type": content_type}
+            )
             file_doc = {
-                "id": str(uuid.uuid4()),
+                "id": file_id,
                 "filename": filename,
-                "data": Binary(file_data),
                 "content_type": content_type,
                 "uploaded_at": datetime.utcnow()
             }
@@ -182,7 +357,10 @@ class Course:
                 {"_id": course_id},
                 {"$push": {"files": file_doc}}
             )
-            return result.modified_count > 0
+            if result.modified_count == 0:
+                get_course_files().delete(file_id)
+                return False
+            return True
         except Exception as e:
             print(f"Error adding file: {str(e)}")
             return False
@@ -190,7 +368,8 @@ class Course:
     @staticmethod
     def get_files(course_id):
         try:
-            course = courses.find_one({"_id": course_id})
+            # files uploaded before GridFS still have their content in the document, never load it
+            course = courses.find_one({"_id": course_id}, {"files.data": 0})
             return [{
                     "id": f["id"],  
                     "filename": f["filename"],
@@ -204,11 +383,12 @@ class Course:
 
     @staticmethod
     def get_file(course_id, filename):
+        """Return the metadata of a file, without its content"""
         try:
-            course = courses.find_one({
-                "_id": course_id,
-                "files.filename": filename
-            }, {"files.$": 1})
+            course = courses.find_one(
+                {"_id": course_id},
+                {"files": {"$elemMatch": {"filename": filename}}}
+            )
             
             if course and course.get('files'):
                 return course['files'][0]
@@ -217,61 +397,41 @@ class Course:
             print(f"Error getting file: {str(e)}")
             return None
 
+    @staticmethod
+    def open_file(file_doc):
+        """Return (length, iterator over the chunks of the file content)"""
+        if "data" in file_doc:
+            # file uploaded before GridFS, its content is in the course document
+            data = bytes(file_doc["data"])
+            return len(data), iter([data])
+
+        grid_out = get_course_files().get(file_doc["id"])
+
+        def read_chunks():
+            try:
+                while True:
+                    chunk = grid_out.readchunk()
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                grid_out.close()
+
+        return grid_out.length, read_chunks()
+
     @staticmethod
     def delete_file(course_id, filename):
         try:
+            file_doc = Course.get_file(course_id, filename)
+            if not file_doc:
+                return False
             result = courses.update_one(
                 {"_id": course_id},
                 {"$pull": {"files": {"filename": filename}}}
             )
+            if "data" not in file_doc:
+                get_course_files().delete(file_doc["id"])
             return result.modified_count > 0
         except Exception as e:
             print(f"Error deleting file: {str(e)}")
-            return False 
-
-    @staticmethod
-    def update_ranking(course_id, user_id, user_name, points_earned):
-        try:
-            # Try to update existing ranking
-            result = courses.update_one(
-                {
-                    "_id": course_id,
-                    "rankings.user_id": user_id
-                },
-                {
-                    "$inc": {"rankings.$.points": points_earned}
-                }
-            )
-            
-            # If user not found in rankings, add them
-            if result.modified_count == 0:
-                courses.update_one(
-                    {"_id": course_id},
-                    {
-                        "$push": {
-                            "rankings": {
-                                "user_id": user_id,
-                                "user_name": user_name,
-                                "points": points_earned
-                            }
-                        }
-                    }
-                )
-            return True
-        except Exception as e:
-            print(f"Error updating ranking: {str(e)}")
             return False
-
-    @staticmethod
-    def get_rankings(course_id):
-        try:
-            course = courses.find_one({"_id": course_id})
-            if course and "rankings" in course:
-                rankings = sorted(course["rankings"], 
-                                key=lambda x: x["points"], 
-                                reverse=True)
-                return rankings
-            return []
-        except Exception as e:
-            print(f"Error getting rankings: {str(e)}")
-            return [] 
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Shared Mongo connection of the backend.
+
+The client is created on first use (and again in a forked worker), with the pool, timeouts and
+read preference of the config. Every command is timed by a command listener, per collection and
+command name, see get_query_stats.
+"""
+import os
+import threading
+import time
+
+import pymongo
+from pymongo import monitoring
+
+from config import Config
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class QueryTimer(monitoring.CommandListener):
+    """Records the latency of every command by (collection, command name)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}  # (connection, request id) -> (collection, command name, start)
+        self._stats = {}
+        self._observers = []
+
+    def add_observer(self, observer):
+        """observer(collection, command name, seconds, failed) is called after every command"""
+        self._observers.append(observer)
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = "<database>"
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (collection, event.command_name, time.perf_counter())
+
+    def _finished(self, event, failed):
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+            if started is None:
+                return
+            collection, command_name, _ = started
+            seconds = event.duration_micros / 1e6
+            stats = self._stats.setdefault(
+                (collection, command_name), {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            )
+            stats["count"] += 1
+            stats["errors"] += int(failed)
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if seconds * 1000 >= Config.MONGO_SLOW_QUERY_MS:
+            print(f"Slow Mongo query: {command_name} on {collection} took {seconds * 1000:.0f} ms")
+        for observer in self._observers:
+            try:
+                observer(collection, command_name, seconds, failed)
+            except Exception as e:
+                print(f"Error in Mongo command observer: {str(e)}")
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {f"{collection}.{command}": dict(values) for (collection, command), values in self._stats.items()}
+        for values in stats.values():
+            values["mean_seconds"] = values["total_seconds"] / values["count"] if values["count"] else 0.0
+        return stats
+
+
+query_timer = QueryTimer()
+
+
+def get_client() -> pymongo.MongoClient:
+    """Return the client of the current process, connecting on first use."""
+    global _client, _client_pid
+    with _client_lock:
+        # a client must not be used across a fork
+        if _client is None or _client_pid != os.getpid():
+            _client = pymongo.MongoClient(
+                Config.MONGODB_URI,
+                maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=Config.MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS,
+                readPreference=Config.MONGO_READ_PREFERENCE,
+                appname="questudy-backend",
+                event_listeners=[query_timer],
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_db():
+    return get_client()[Config.MONGO_DB_NAME]
+
+
+class LazyCollection:
+    """Collection handle that can be created at import time, the client is only created on first use."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(get_db()[self.name], attribute)
+
+
+def get_query_stats() -> dict:
+    """Count, errors, total, mean and max latency by "collection.command"."""
+    return query_timer.stats()
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+import uuid
+from models.db import LazyCollection
+
+jobs = LazyCollection("jobs")
+
+class Job:
+    @staticmethod
+    def create_indexes():
+        # Finished jobs are only polled for a short while, let Mongo remove them after a day
+        jobs.create_index("created_at", expireAfterSeconds=24 * 3600)
+
+    @staticmethod
+    def create_job(user_id, job_type, params):
+        job = {
+            "_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "type": job_type,
+            "params": params,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0.0,
+            "stages": [],
+            "failed_questions": 0,
+            "result": None,
+            "error": None,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        jobs.insert_one(job)
+        return job["_id"]
+
+    @staticmethod
+    def start_job(job_id):
+        """Mark a queued job as running, returns False if it is not queued anymore (e.g. it was failed meanwhile)"""
+        try:
+            result = jobs.update_one(
+                {"_id": job_id, "status": "queued"},
+                {"$set": {"status": "running", "updated_at": datetime.utcnow()}}
+            )
+            return result.matched_count > 0
+        except Exception as e:
+            print(f"Error starting job: {str(e)}")
+            return True
+
+    @staticmethod
+    def update_progress(job_id, stage, progress, new_stage=False, failed_questions=0):
+        """
+        Record the current stage and overall progress (0 to 1), new_stage also appends the stage to the timeline.
+        failed_questions is added to the count of questions dropped for lack of a reference text.
+        """
+        try:
+            update = {
+                "$set": {
+                    "status": "running",
+                    "stage": stage,
+                    "progress": round(progress, 3),
+                    "updated_at": datetime.utcnow()
+                }
+            }
+            if new_stage:
+                update["$push"] = {"stages": {"name": stage, "started_at": datetime.utcnow()}}
+            if failed_questions:
+                update["$inc"] = {"failed_questions": failed_questions}
+            # a failed job stays failed, even if its processing goes on
+            jobs.update_one({"_id": job_id, "status": {"$ne": "failed"}}, update)
+        except Exception as e:
+            print(f"Error updating job progress: {str(e)}")
+
+    @staticmethod
+    def complete_job(job_id, result):
+        """Returns False if the job was failed meanwhile, e.g. as stale"""
+        updated = jobs.update_one(
+            {"_id": job_id, "status": {"$ne": "failed"}},
+            {
+                "$set": {
+                    "status": "done",
+                    "stage": "done",
+                    "progress": 1.0,
+                    "result": result,
+                    "updated_at": datetime.utcnow()
+                },
+                "$push": {"stages": {"name": "done", "started_at": datetime.utcnow()}}
+            }
+        )
+        return updated.matched_count > 0
+
+    @staticmethod
+    def fail_job(job_id, error):
+        try:
+            jobs.update_one(
+                {"_id": job_id},
+                {"$set": {"status": "failed", "error": error, "updated_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            print(f"Error failing job: {str(e)}")
+
+    @staticmethod
+    def get_job(job_id):
+        try:
+            return jobs.find_one({"_id": job_id})
+        except Exception as e:
+            print(f"Error getting job: {str(e)}")
+            return None
+
+    @staticmethod
+    def fail_if_stale(job, stale_seconds):
+        """
+        Fail a running job whose progress was not updated for stale_seconds, its process was
+        killed (e.g. a web worker restarted by gunicorn) and nobody else will finish it.
+        Queued jobs are waiting for a free ingestion process, they are never stale.
+        Returns the job as it is now.
+        """
+        if job["status"] != "running":
+            return job
+        if datetime.utcnow() - job["updated_at"] < timedelta(seconds=stale_seconds):
+            return job
+        try:
+            result = jobs.update_one(
+                # only if it was not updated meanwhile
+                {"_id": job["_id"], "status": job["status"], "updated_at": job["updated_at"]},
+                {"$set": {"status": "failed", "error": "Processing was interrupted", "updated_at": datetime.utcnow()}}
+            )
+            if result.modified_count:
+                print(f"Failed stale job {job['_id']}")
+            return jobs.find_one({"_id": job["_id"]}) or job
+        except Exception as e:
+            print(f"Error failing stale job: {str(e)}")
+            return job
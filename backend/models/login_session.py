@@ -0,0 +1,13 @@
+from config import Config
+from models.db import LazyCollection
+
+# written by Flask-Session (SESSION_TYPE=mongodb), see middleware/sessions.py
+login_sessions = LazyCollection(Config.SESSION_MONGODB_COLLECT)
+
+class LoginSession:
+    @staticmethod
+    def create_indexes():
+        # Flask-Session stores the expiry of a session in "expiration", Mongo removes expired sessions
+        login_sessions.create_index("expiration", expireAfterSeconds=0)
+        # every request loads, upserts or deletes its session by {"id": store_id}
+        login_sessions.create_index("id", unique=True)
@@ -0,0 +1,99 @@
+"""
+Index creation and data migrations, run once at boot (or with `python -m models.migrations`)
+instead of on every import of the models.
+
+Indexes are ensured on every run, creating an existing index is a no-op. Data migrations are
+recorded in the migrations collection and only applied once. A migration still claimed after
+MONGO_MIGRATION_STALE_SECONDS was interrupted and is taken over, so migrations must be idempotent.
+If Mongo can't be reached, the remaining steps are skipped until the next boot.
+"""
+from datetime import datetime, timedelta
+
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+
+from config import Config
+from models.db import LazyCollection
+from models.user import User
+from models.course import Course
+from models.job import Job
+from models.ranking import Ranking
+from models.quiz_session import QuizSession
+from models.quiz import Quiz
+from models.login_session import LoginSession
+
+migrations = LazyCollection("migrations")
+
+INDEXES = [
+    User.create_indexes,
+    Course.create_indexes,
+    Job.create_indexes,
+    Ranking.create_indexes,
+    QuizSession.create_indexes,
+    Quiz.create_indexes,
+    LoginSession.create_indexes,
+]
+
+# Applied in order, never rename or remove an entry
+DATA_MIGRATIONS = [
+    ("move_course_rankings_to_collection", Ranking.migrate_course_rankings),
+    ("add_course_search_terms", Course.add_missing_search_terms),
+]
+
+
+def claim_migration(name):
+    """
+    Claim the migration, returns False if it is done or claimed by another worker booting at the same time.
+    A claim older than MONGO_MIGRATION_STALE_SECONDS is taken over.
+    """
+    now = datetime.utcnow()
+    try:
+        migrations.insert_one({"_id": name, "status": "running", "started_at": now})
+        return True
+    except DuplicateKeyError:
+        stale_before = now - timedelta(seconds=Config.MONGO_MIGRATION_STALE_SECONDS)
+        taken_over = migrations.find_one_and_update(
+            {"_id": name, "status": "running", "started_at": {"$lt": stale_before}},
+            {"$set": {"started_at": now}}
+        )
+        if taken_over is not None:
+            print(f"Taking over interrupted migration {name}")
+        return taken_over is not None
+
+
+def run_migrations():
+    for create_indexes in INDEXES:
+        try:
+            create_indexes()
+        except ConnectionFailure as e:
+            # every other step would wait for the server selection timeout too
+            print(f"Mongo unreachable, skipping migrations: {str(e)}")
+            return
+        except Exception as e:
+            print(f"Error creating indexes: {str(e)}")
+
+    for name, migrate in DATA_MIGRATIONS:
+        try:
+            if not claim_migration(name):
+                continue
+        except Exception as e:
+            print(f"Error claiming migration {name}: {str(e)}")
+            return
+
+        try:
+            if migrate() is False:
+                raise RuntimeError("migration returned False")
+            migrations.update_one({"_id": name}, {"$set": {"status": "done", "finished_at": datetime.utcnow()}})
+            print(f"Applied migration {name}")
+        except ConnectionFailure as e:
+            # the claim can't be released either, it is taken over once stale
+            print(f"Mongo unreachable in migration {name}: {str(e)}")
+            return
+        except Exception as e:
+            print(f"Error in migration {name}: {str(e)}")
+            # released so the next boot retries it
+            migrations.delete_one({"_id": name})
+            return
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -0,0 +1,51 @@
+from datetime import datetime
+import random
+from models.db import LazyCollection
+
+question_banks = LazyCollection("question_banks")
+
+class QuestionBank:
+    """
+    Question sets already generated for a file, one document per file content hash and generation settings.
+    The _id is the bank key, so a lookup is a single _id query.
+    """
+
+    @staticmethod
+    def make_key(file_hash, settings):
+        settings_part = ",".join(f"{name}={settings[name]}" for name in sorted(settings))
+        return f"{file_hash}:{settings_part}"
+
+    @staticmethod
+    def get_random_set(file_hash, settings):
+        """Return one of the question sets stored for the file and settings, or None"""
+        try:
+            bank = question_banks.find_one(
+                {"_id": QuestionBank.make_key(file_hash, settings)},
+                {"question_sets": 1}
+            )
+            if not bank or not bank.get("question_sets"):
+                return None
+            return random.choice(bank["question_sets"])
+        except Exception as e:
+            print(f"Error getting question set: {str(e)}")
+            return None
+
+    @staticmethod
+    def add_set(file_hash, settings, chunks, max_sets):
+        """Store a generated question set, only the max_sets most recent sets are kept"""
+        try:
+            question_banks.update_one(
+                {"_id": QuestionBank.make_key(file_hash, settings)},
+                {
+                    "$setOnInsert": {
+                        "file_hash": file_hash,
+                        "settings": settings,
+                        "created_at": datetime.utcnow()
+                    },
+                    "$set": {"updated_at": datetime.utcnow()},
+                    "$push": {"question_sets": {"$each": [chunks], "$slice": -max_sets}}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error storing question set: {str(e)}")
@@ -0,0 +1,33 @@
+from datetime import datetime
+import uuid
+from models.db import LazyCollection
+
+quizzes = LazyCollection("quizzes")
+
+class Quiz:
+    """Chunks (reference texts and questions) a quiz is started from, the session only keeps the quiz id."""
+
+    @staticmethod
+    def create_indexes():
+        # A quiz is started right after its files are processed, let Mongo remove the chunks after a day
+        quizzes.create_index("created_at", expireAfterSeconds=24 * 3600)
+
+    @staticmethod
+    def create_quiz(chunks, question_count):
+        quiz = {
+            "_id": str(uuid.uuid4()),
+            "chunks": chunks,
+            "question_count": question_count,
+            "created_at": datetime.utcnow()
+        }
+        quizzes.insert_one(quiz)
+        return quiz["_id"]
+
+    @staticmethod
+    def get_chunks(quiz_id):
+        try:
+            quiz = quizzes.find_one({"_id": quiz_id}, {"chunks": 1})
+            return quiz["chunks"] if quiz else None
+        except Exception as e:
+            print(f"Error getting quiz chunks: {str(e)}")
+            return None
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+from models.db import LazyCollection
+
+quiz_sessions = LazyCollection("quiz_sessions")
+
+class QuizSession:
+    """State of a quiz in progress (Chat.to_dict), one document per quiz session id."""
+
+    @staticmethod
+    def create_indexes():
+        # Abandoned quizzes are removed by Mongo once they expire
+        quiz_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def save(session_id, state, ttl_seconds):
+        now = datetime.utcnow()
+        quiz_sessions.replace_one(
+            {"_id": session_id},
+            {"state": state, "updated_at": now, "expires_at": now + timedelta(seconds=ttl_seconds)},
+            upsert=True
+        )
+
+    @staticmethod
+    def get(session_id):
+        # the TTL monitor only runs every minute, expired documents can still be there
+        document = quiz_sessions.find_one({"_id": session_id, "expires_at": {"$gt": datetime.utcnow()}})
+        return document["state"] if document else None
+
+    @staticmethod
+    def count_live():
+        return quiz_sessions.count_documents({"expires_at": {"$gt": datetime.utcnow()}})
+
+    @staticmethod
+    def delete(session_id):
+        quiz_sessions.delete_one({"_id": session_id})
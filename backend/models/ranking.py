@@ -0,0 +1,121 @@
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from models.db import LazyCollection
+
+rankings = LazyCollection("rankings")
+courses = LazyCollection("courses")
+
+# Leaderboard order: most points first, ties broken by user id so the order is stable
+LEADERBOARD_SORT = [("points", DESCENDING), ("user_id", ASCENDING)]
+
+class Ranking:
+    """One document per (course, user), its _id is "<course_id>:<user_id>"."""
+
+    @staticmethod
+    def create_indexes():
+        rankings.create_index([("course_id", ASCENDING), ("points", DESCENDING), ("user_id", ASCENDING)])
+
+    @staticmethod
+    def add_points(course_id, user_id, user_name, points_earned):
+        """Add points to the user's ranking in a single atomic upsert"""
+        try:
+            rankings.update_one(
+                {"_id": f"{course_id}:{user_id}"},
+                {
+                    "$inc": {"points": points_earned},
+                    "$set": {"user_name": user_name, "updated_at": datetime.utcnow()},
+                    "$setOnInsert": {"course_id": course_id, "user_id": user_id}
+                },
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            print(f"Error updating ranking: {str(e)}")
+            return False
+
+    @staticmethod
+    def add_points_many(increments):
+        """
+        Apply aggregated awards in a single bulk write.
+        increments maps (course_id, user_id) to {"points": ..., "user_name": ...}
+        """
+        operations = [
+            UpdateOne(
+                {"_id": f"{course_id}:{user_id}"},
+                {
+                    "$inc": {"points": increment["points"]},
+                    "$set": {"user_name": increment["user_name"], "updated_at": datetime.utcnow()},
+                    "$setOnInsert": {"course_id": course_id, "user_id": user_id}
+                },
+                upsert=True
+            )
+            for (course_id, user_id), increment in increments.items()
+        ]
+        if operations:
+            rankings.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    @staticmethod
+    def get_top(course_id, limit, offset=0):
+        """Return a page of the leaderboard, read in index order"""
+        try:
+            cursor = rankings.find(
+                {"course_id": course_id},
+                {"_id": 0, "user_id": 1, "user_name": 1, "points": 1}
+            ).sort(LEADERBOARD_SORT).skip(offset).limit(limit)
+            return list(cursor)
+        except Exception as e:
+            print(f"Error getting rankings: {str(e)}")
+            return []
+
+    @staticmethod
+    def get_user_rank(course_id, user_id):
+        """
+        Return (rank, ranking) of the user, or (None, None) if the user has no points in the course.
+        The rank only counts the users ahead in the index, the leaderboard is never loaded.
+        """
+        try:
+            ranking = rankings.find_one(
+                {"_id": f"{course_id}:{user_id}"},
+                {"_id": 0, "user_id": 1, "user_name": 1, "points": 1}
+            )
+            if not ranking:
+                return None, None
+            ahead = rankings.count_documents({
+                "course_id": course_id,
+                "$or": [
+                    {"points": {"$gt": ranking["points"]}},
+                    {"points": ranking["points"], "user_id": {"$lt": user_id}}
+                ]
+            })
+            return ahead + 1, ranking
+        except Exception as e:
+            print(f"Error getting user rank: {str(e)}")
+            return None, None
+
+    @staticmethod
+    def migrate_course_rankings():
+        """Move the rankings still embedded in course documents to the rankings collection"""
+        try:
+            for course in courses.find({"rankings.0": {"$exists": True}}, {"rankings": 1}):
+                operations = [
+                    UpdateOne(
+                        {"_id": f"{course['_id']}:{ranking['user_id']}"},
+                        {
+                            "$max": {"points": ranking.get("points", 0)},
+                            "$setOnInsert": {
+                                "course_id": course["_id"],
+                                "user_id": ranking["user_id"],
+                                "user_name": ranking.get("user_name")
+                            }
+                        },
+                        upsert=True
+                    )
+                    for ranking in course["rankings"]
+                ]
+                rankings.bulk_write(operations, ordered=False)
+                courses.update_one({"_id": course["_id"]}, {"$unset": {"rankings": ""}})
+            return True
+        except Exception as e:
+            print(f"Error migrating rankings: {str(e)}")
+            return False
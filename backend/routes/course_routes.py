@@ -1,20 +1,39 @@
-from flask import Blueprint, request, jsonify, session, send_file
+from flask import Blueprint, request, jsonify, session, Response
 from models.course import Course
 from flask_cors import cross_origin
 from middleware.auth import login_required
 from models.user import User
-import io
+from models.ranking import Ranking
 
 course_bp = Blueprint('course_bp', __name__, url_prefix='/api')
 
+def paginated_response(items, next_cursor):
+    """ The body stays a plain list, the token of the next page is sent in the X-Next-Cursor header """
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def parse_limit(default, maximum):
+    """ Page size of the limit argument, clamped between 1 and maximum, None if it is not a number """
+    try:
+        return max(1, min(int(request.args.get('limit', default)), maximum))
+    except ValueError:
+        return None
+
 @course_bp.route('/courses', methods=['GET'])
 @cross_origin(supports_credentials=True)
 @login_required
 def get_courses():
+    limit = parse_limit(50, 100)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
     try:
         user_id = session.get('user_id')
-        user_courses = Course.get_user_courses(user_id)
-        return jsonify(user_courses)
+        user_courses, next_cursor = Course.get_user_courses(user_id, limit, request.args.get('cursor'))
+        return paginated_response(user_courses, next_cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         print(f"Error fetching courses: {str(e)}")
         return jsonify({'error': 'Failed to fetch courses'}), 500
@@ -43,13 +62,20 @@ def create_course():
 @cross_origin(supports_credentials=True)
 @login_required
 def search_courses():
+    limit = parse_limit(20, 50)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
     try:
         query = request.args.get('q', '')
         if not query:
             return jsonify([])
             
-        search_results = Course.search_courses(query)
-        return jsonify(search_results)
+        search_results, next_cursor = Course.search_courses(
+            query, session.get('user_id'), limit, request.args.get('cursor')
+        )
+        return paginated_response(search_results, next_cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         print(f"Error searching courses: {str(e)}")
         return jsonify({'error': 'Failed to search courses'}), 500
@@ -104,8 +130,8 @@ def upload_file(course_id):
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
 
-        file_data = file.read()
-        if Course.add_file(course_id, file_data, file.filename, file.content_type):
+        # the upload is copied to GridFS chunk by chunk instead of being read into memory
+        if Course.add_file(course_id, file.stream, file.filename, file.content_type):
             return jsonify({'message': 'File uploaded successfully'})
         return jsonify({'error': 'Failed to upload file'}), 500
     except Exception as e:
@@ -134,12 +160,12 @@ def download_file(course_id, filename):
     try:
         file_doc = Course.get_file(course_id, filename)
         if file_doc:
-            return send_file(
-                io.BytesIO(file_doc['data']),
-                mimetype=file_doc['content_type'],
-                as_attachment=True,
-                download_name=filename
-            )
+            # the content is sent chunk by chunk as it is read from GridFS
+            length, chunks = Course.open_file(file_doc)
+            response = Response(chunks, mimetype=file_doc['content_type'])
+            response.headers['Content-Length'] = str(length)
+            response.headers.set('Content-Disposition', 'attachment', filename=filename)
+            return response
         return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         print(f"Error downloading file: {str(e)}")
@@ -175,16 +201,24 @@ def get_course(course_id):
 @login_required
 def get_course_rankings(course_id):
     try:
-        rankings = Course.get_rankings(course_id)
+        limit = min(int(request.args.get('limit', 50)), 200)
+        offset = max(int(request.args.get('offset', 0)), 0)
         user_id = session.get('user_id')
-        
-        # Find user's rank
-        user_rank = next((index + 1 for (index, r) in enumerate(rankings) 
-                         if r["user_id"] == user_id), None)
+
+        # one more than the page to know if there is a next page
+        rankings = Ranking.get_top(course_id, limit + 1, offset)
+        has_more = len(rankings) > limit
+        rankings = rankings[:limit]
+        for position, ranking in enumerate(rankings):
+            ranking['rank'] = offset + position + 1
+
+        user_rank, user_ranking = Ranking.get_user_rank(course_id, user_id)
         
         return jsonify({
             "rankings": rankings,
-            "userRank": user_rank
+            "userRank": user_rank,
+            "userRanking": user_ranking,
+            "hasMore": has_more
         })
     except Exception as e:
         print(f"Error fetching rankings: {str(e)}")
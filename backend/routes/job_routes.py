@@ -0,0 +1,41 @@
+from flask import Blueprint, jsonify, session
+from flask_cors import cross_origin
+from middleware.auth import login_required
+from models.job import Job
+from config import Config
+from uuid import uuid4
+
+job_bp = Blueprint('job_bp', __name__, url_prefix='/api')
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+@cross_origin(supports_credentials=True)
+@login_required
+def get_job_status(job_id):
+    try:
+        job = Job.get_job(job_id)
+        if not job or job['user_id'] != session.get('user_id'):
+            return jsonify({'error': 'Job not found'}), 404
+        job = Job.fail_if_stale(job, Config.JOB_STALE_SECONDS)
+
+        # The first poll seeing the job done starts a new quiz, the session only keeps the id of its chunks
+        if job['status'] == 'done' and session.get('ingestion_job_id') != job_id:
+            session['quiz_id'] = job['result']['quiz_id']
+            session['question_count'] = job['params'].get('question_count')
+            session['session_id'] = str(uuid4())
+            session['ingestion_job_id'] = job_id
+
+        return jsonify({
+            'job_id': job['_id'],
+            'status': job['status'],
+            'stage': job['stage'],
+            'progress': job['progress'],
+            'stages': [
+                {'name': stage['name'], 'started_at': stage['started_at'].isoformat()}
+                for stage in job.get('stages', [])
+            ],
+            'failed_questions': job.get('failed_questions', 0),
+            'error': job.get('error')
+        })
+    except Exception as e:
+        print(f"Error fetching job {job_id}: {str(e)}")
+        return jsonify({'error': 'Failed to fetch job'}), 500
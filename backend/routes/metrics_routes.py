@@ -0,0 +1,26 @@
+import hmac
+import ipaddress
+from flask import Blueprint, Response, request, jsonify
+from services.metrics import render_metrics
+from config import Config
+
+# Prometheus scrapes /metrics, outside of the /api prefix
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+
+def metrics_allowed():
+    """ With METRICS_TOKEN, the scraper sends it as a bearer token, without it only private addresses are served """
+    if Config.METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {Config.METRICS_TOKEN}")
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    if not metrics_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, session
 from services.chat.chat import Chat
 from flask_cors import cross_origin
-from services.process_and_chunk_pdf.process_pdf_workflow import divide_dataset_in_sections
+from services.jobs.ingestion import submit_ingestion_job
 from middleware.auth import login_required
 from models.course import Course
 import io
@@ -35,23 +35,19 @@ def upload_pdf():
         # Get file data and question count
         file_data = file.read()
         question_count = int(request.form.get('questionCount', 3))
+        # regenerate=true asks for new questions even if the file is already in the question bank
+        regenerate = request.form.get('regenerate', 'false').lower() == 'true'
         print(f"Question count: {question_count}")
         print(f"File size: {len(file_data)} bytes")
 
         try:
-            # Pass the bytes directly instead of creating a new BytesIO object
-            result = divide_dataset_in_sections(file_data, question_count)
-            print("File processed successfully")
-            
-            # Store results in session
-            session['chunks'] = result
-            session['question_count'] = question_count
-            
-            print(f"Saving following chunks in session: {result}")
-            return jsonify({'message': 'File processed successfully'})
+            # The file is processed in the background, the client polls /api/jobs/<job_id>
+            job_id = submit_ingestion_job(session['user_id'], [file_data], question_count, regenerate)
+            print(f"Queued ingestion job {job_id}")
+            return jsonify({'message': 'File accepted for processing', 'job_id': job_id}), 202
             
         except Exception as process_error:
-            print(f"Error processing file content: {str(process_error)}")
+            print(f"Error queuing file processing: {str(process_error)}")
             print(f"Error type: {type(process_error)}")
             import traceback
             print(f"Traceback: {traceback.format_exc()}")
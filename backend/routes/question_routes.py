@@ -1,36 +1,38 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context
 from services.chat.chat import Chat
+from models.quiz import Quiz
 from flask_cors import cross_origin
 from services.chat.rewrite_answers import rewrite_answer, rewrite_hint
-from services.process_and_chunk_pdf.process_pdf_workflow import divide_dataset_in_sections
+from services.jobs.ingestion import submit_ingestion_job
 from uuid import uuid4
 import os
+import json
 from middleware.auth import login_required
-from models.course import Course
+from services.ranking_buffer import award_points
+from services.session_store import load_chat, save_chat, delete_chat
+from services.tracing import span
+from config import Config
 
 # Blueprint setup
 question_bp = Blueprint('question_bp', __name__, url_prefix='/api')
 
-# store chat object as they aren't serializable
-session_store = {}
-
-
 
 def get_chat_session(session_id):
-    """ Helper function to get or initialize a Chat session """
-    if session_id not in session_store:
-        # Retrieve the file path from the session
-        initial_questions = session.get('chunks') 
-        print("initial questions ", initial_questions)
+    """ Helper function to get or initialize a Chat session, quizzes in progress live in the shared session store """
+    chat_session = load_chat(session_id)
+    if chat_session is None:
+        # Retrieve the chunks of the quiz started in the session
+        quiz_id = session.get('quiz_id')
+        initial_questions = Quiz.get_chunks(quiz_id) if quiz_id else None
         
         if initial_questions:
             chat_session = Chat(initial_questions=initial_questions)
-            session_store[session_id] = chat_session
+            save_chat(session_id, chat_session)
         else:
             # Handle the case where the file path is not set or the file does not exist
             raise FileNotFoundError("chunks not found in session") 
     
-    return session_store[session_id]
+    return chat_session
 
 @question_bp.route('/get_question', methods=['GET'])
 @login_required
@@ -43,7 +45,6 @@ def get_next_question():
         session['session_id'] = session_id
     
     result = {}
-    print("chunks in session ", session.get('chunks'))
     chat_session = get_chat_session(session_id) 
 
     current_question = chat_session.chat_manager.get_current_question()
@@ -59,11 +60,10 @@ def get_next_question():
     else:
         # no more questions available
         result["chat_evaluation"] = chat_session.get_chat_evaluation()
-        # Remove session data from memory
-        if session_id in session_store:
-            del session_store[session_id]
+        # Remove the quiz from the session store
+        delete_chat(session_id)
         session.pop('session_id', None)
-        session.pop('chunks', None)
+        session.pop('quiz_id', None)
         return jsonify(result), 200
 
 @question_bp.route('/quit_quiz', methods=['POST'])
@@ -71,12 +71,12 @@ def quit_quiz():
     """ Reset only the chat/question state without clearing the entire session """
     session_id = session.get('session_id')
     
-    if session_id and session_id in session_store:
-        # Only remove the chat session from the session_store
-        del session_store[session_id]
+    if session_id:
+        # Only remove the chat session from the session store
+        delete_chat(session_id)
         # Remove only quiz-related session data
         session.pop('session_id', None)
-        session.pop('chunks', None)
+        session.pop('quiz_id', None)
 
     return jsonify({"message": "Quiz state reset successfully"}), 200
 
@@ -87,9 +87,8 @@ def reset_session():
     print('resetting session')
     
     if session_id:
-        # Remove the chat session from the session_store
-        if session_id in session_store:
-            del session_store[session_id]  # Clear the stored Chat object
+        # Remove the chat session from the session store
+        delete_chat(session_id)
         
         session.clear()  # Clear the entire session
 
@@ -103,42 +102,107 @@ def submit_answer():
     answer = request.json.get('answer') 
     question = request.json.get('question')
     session_id = session.get('session_id') 
- 
-    answer = rewrite_answer(question, answer)
 
-    if not session_id or session_id not in session_store:
+    chat_session = load_chat(session_id) if session_id else None
+    if chat_session is None:
         print("session id ", session_id)
-        print("session store ", session_store)
         return jsonify({"error": "Session not found"}), 400
 
-    chat_session = get_chat_session(session_id)
-
     current_question = chat_session.chat_manager.get_current_question()
     if current_question:
-        result = chat_session.process_and_evaluate_answer(answer)
-        
-        # Add points based on feedback
-        points_earned = 0
-        if result.get('feedback') == "Perfect!":
-            points_earned = 10
-        elif result.get('feedback') == "Correct":
-            points_earned = 5
-        elif result.get('subquestion'):
-            points_earned = 3
-            
-        if points_earned > 0:
-            Course.update_ranking(
-                session.get('current_course_id'),
-                session.get('user_id'),
-                session.get('user_name'),
-                points_earned
-            )
-            
+        with span("evaluate_answer", combined=Config.COMBINED_EVALUATION):
+            if Config.COMBINED_EVALUATION:
+                # rewrite, evaluation and refinement questions in one chatbot call
+                result = chat_session.process_and_evaluate_raw_answer(question, answer)
+            else:
+                answer = rewrite_answer(question, answer)
+                result = chat_session.process_and_evaluate_answer(answer)
+        save_chat(session_id, chat_session)
+        award_answer_points(
+            result,
+            session.get('current_course_id'),
+            session.get('user_id'),
+            session.get('user_name')
+        )
         return jsonify(result), 200
     else:
         return jsonify({"error": "No current question available"}), 400
 
 
+def award_answer_points(result, course_id, user_id, user_name):
+    """ Add points to the user's ranking based on the feedback """
+    points_earned = 0
+    if result.get('feedback') == "Perfect!":
+        points_earned = 10
+    elif result.get('feedback') == "Correct":
+        points_earned = 5
+    elif result.get('subquestion'):
+        points_earned = 3
+        
+    # without a current course the ranking key would be "None:<user_id>"
+    if points_earned > 0 and course_id and user_id:
+        award_points(
+            course_id,
+            user_id,
+            user_name,
+            points_earned
+        )
+
+
+def format_sse(event, data):
+    """ Format a server-sent event with a JSON payload """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@question_bp.route("/submit_answer/stream", methods=['POST', 'OPTIONS'])
+@cross_origin(supports_credentials=True)
+def submit_answer_stream():
+    """
+    Streaming variant of submit_answer, the evaluation is sent as server-sent events:
+    "answer" (the rewritten answer), "feedback" tokens, the "verdict", "hint" tokens,
+    the "followup" questions, and finally the "result" that submit_answer would return.
+    """
+    answer = request.json.get('answer') 
+    question = request.json.get('question')
+    session_id = session.get('session_id') 
+
+    chat_session = load_chat(session_id) if session_id else None
+    if chat_session is None:
+        return jsonify({"error": "Session not found"}), 400
+
+    if not chat_session.chat_manager.get_current_question():
+        return jsonify({"error": "No current question available"}), 400
+
+    course_id = session.get('current_course_id')
+    user_id = session.get('user_id')
+    user_name = session.get('user_name')
+
+    def generate():
+        try:
+            rewritten_answer = rewrite_answer(question, answer)
+            yield format_sse("answer", {"answer": rewritten_answer})
+
+            for event, data in chat_session.process_and_evaluate_answer_stream(rewritten_answer):
+                if event == "result":
+                    save_chat(session_id, chat_session)
+                    award_answer_points(data, course_id, user_id, user_name)
+                elif event in ("feedback", "hint"):
+                    data = {"delta": data}
+                yield format_sse(event, data)
+        except Exception as e:
+            print(f"Error streaming answer evaluation: {str(e)}")
+            yield format_sse("error", {"error": "Failed to evaluate answer"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # let nginx forward events as soon as they are written
+        }
+    )
+
+
 @question_bp.route("/rewrite_answer", methods=['POST'])
 @cross_origin(supports_credentials=True)
 def rewrite_answer_endpoint():
@@ -162,29 +226,18 @@ def upload_process_pdfs():
     
     files = request.files.getlist('files')
     question_count = int(request.form.get('questionCount', 3))
+    regenerate = request.form.get('regenerate', 'false').lower() == 'true'
     
     try:
-        # Process multiple PDFs and combine their content
-        combined_content = []
+        files_data = []
         for file in files:
             if not file.filename.lower().endswith('.pdf'):
                 return jsonify({"error": f"Invalid file type for {file.filename}. Only PDFs are supported."}), 400
-                
-            file_data = file.read()
-            # Use the existing divide_dataset_in_sections function
-            content = divide_dataset_in_sections(file_data, question_count)
-            if content:
-                combined_content.extend(content)
-            file.seek(0)  # Reset file pointer for next read
-        
-        if not combined_content:
-            return jsonify({"error": "No content could be extracted from the files"}), 400
-        
-        # Store in session
-        session['chunks'] = combined_content
-        session['session_id'] = str(uuid4())
-        
-        return jsonify({"message": "Files processed successfully"}), 200
+            files_data.append(file.read())
+
+        # The files are processed in the background, the client polls /api/jobs/<job_id>
+        job_id = submit_ingestion_job(session['user_id'], files_data, question_count, regenerate)
+        return jsonify({"message": "Files accepted for processing", "job_id": job_id}), 202
     except Exception as e:
         print(f"Error processing PDFs: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -219,7 +272,7 @@ def award_quiz_completion():
         # Award 20 points per question completed
         points_earned = score * 20
         
-        success = Course.update_ranking(
+        success = award_points(
             course_id,
             user_id,
             user_name,
@@ -1,22 +1,39 @@
 import json
 from typing import Optional, List, Tuple, Dict
-from openai import OpenAI
 import copy
 import time
 from services.chat.question_node import QuestionNode
-from services.chat.question_evaluator import evaluate_core_answer, evaluate_multiple_refinement_answers
+from services.chat.question_evaluator import evaluate_core_answer, evaluate_multiple_refinement_answers, stream_answer_evaluation, evaluate_answer_combined
 from services.chat.chat_manager import ChatManager
-from services.chat.rewrite_answers import rewrite_hint
+from services.chat.rewrite_answers import rewrite_answer, rewrite_hint, rewrite_hint_stream
 from services.chat.create_questions import create_multiple_refinement_questions
 from services.chat.chat_session_evaluator import evaluate_chat
 
-client = OpenAI()
-
 class Chat:
+    # version of the to_dict format, stored states of another version are discarded
+    STATE_VERSION = 1
+
     def __init__(self, initial_questions: List[dict]):
         self.chat_manager = ChatManager(initial_questions)
         self.chat = []
 
+    def to_dict(self) -> dict:
+        """JSON-serializable state of the quiz, restored with Chat.from_dict"""
+        return {
+            "v": self.STATE_VERSION,
+            "manager": self.chat_manager.to_dict(),
+            "chat": self.chat,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'Chat':
+        if state.get("v") != cls.STATE_VERSION:
+            raise ValueError(f"Unsupported chat state version: {state.get('v')}")
+        chat = cls([])
+        chat.chat_manager = ChatManager.from_dict(state["manager"])
+        chat.chat = state["chat"]
+        return chat
+
 
     def process_and_evaluate_answer(self, answer: str) -> dict:
         current_question = self.chat_manager.get_current_question()
@@ -27,6 +44,56 @@ class Chat:
         elif current_question.question_type == "refinement": 
             score, full_evaluation = evaluate_multiple_refinement_answers(current_question)
 
+        for event, data in self.apply_evaluation(current_question, answer, score, full_evaluation):
+            if event == "result":
+                return data
+
+    def process_and_evaluate_raw_answer(self, question: str, answer: str) -> dict:
+        """
+        Rewrite and evaluate the user's answer, and create the refinement questions, with a single chatbot call.
+        Falls back to the sequential rewrite and evaluation if the response is not valid.
+        """
+        current_question = self.chat_manager.get_current_question()
+
+        try:
+            evaluation = evaluate_answer_combined(current_question, answer)
+        except ValueError as e:
+            print(f"Combined evaluation failed, evaluating sequentially: {str(e)}")
+            return self.process_and_evaluate_answer(rewrite_answer(question, answer))
+
+        current_question.answer = evaluation["answer"]
+        for event, data in self.apply_evaluation(
+            current_question,
+            evaluation["answer"],
+            evaluation["score"],
+            evaluation["feedback"],
+            refinement_questions=evaluation["refinement_questions"]
+        ):
+            if event == "result":
+                return data
+
+    def process_and_evaluate_answer_stream(self, answer: str):
+        """
+        Same as process_and_evaluate_answer, but yields (event, data) tuples while the evaluation is generated:
+        "feedback" tokens, the "verdict", "hint" tokens, the "followup" questions and finally the "result".
+        """
+        current_question = self.chat_manager.get_current_question()
+        current_question.answer = answer
+
+        for event, data in stream_answer_evaluation(current_question):
+            if event == "token":
+                yield "feedback", data
+            else:
+                score, full_evaluation = data
+
+        yield "verdict", {"score": score, "feedback": full_evaluation}
+        yield from self.apply_evaluation(current_question, answer, score, full_evaluation, stream=True)
+
+    def apply_evaluation(self, current_question: QuestionNode, answer: str, score: str, full_evaluation: str, stream: bool = False, refinement_questions: Optional[List[str]] = None):
+        """
+        Record the evaluation and move through the question tree, the last event yielded is the result.
+        Refinement questions are only created if they weren't already generated with the evaluation.
+        """
         self.chat.append({
             "question": current_question.question,
             "answer": answer,
@@ -46,17 +113,29 @@ class Chat:
         if score != "correct" and score != "perfect":
             if current_question.question_type == "basic":
                 # processing core questions
-                multiple_refinement_questions = create_multiple_refinement_questions(current_question, answer, full_evaluation)
+                if refinement_questions:
+                    multiple_refinement_questions = refinement_questions
+                else:
+                    multiple_refinement_questions = create_multiple_refinement_questions(current_question, answer, full_evaluation)
                 print("questions\n", multiple_refinement_questions, "\n\n")
                 self.chat_manager.add_multiple_refinement_questions(current_question, multiple_refinement_questions)
                 result['move_to_next'] = True
+                if stream:
+                    yield "followup", {"questions": multiple_refinement_questions}
             elif len(current_question.feedbacks_given) == 2 and current_question.question_type == "refinement":
                  # question can't be answered, thus moving to next question and says it
                 result["improperly_answered"] = True
                 result["move_to_next"] = True
             elif len(current_question.feedbacks_given) ==1 and current_question.question_type == "refinement":
                 # question already has a feedback, asking it another time with reference text
-                result["text"] = rewrite_hint(current_question.question, current_question.answer, current_question.text)
+                if stream:
+                    hint = []
+                    for token in rewrite_hint_stream(current_question.question, current_question.answer, current_question.text):
+                        hint.append(token)
+                        yield "hint", token
+                    result["text"] = "".join(hint)
+                else:
+                    result["text"] = rewrite_hint(current_question.question, current_question.answer, current_question.text)
         else:
             # if correct or perfect, simply pass to next question
             result["move_to_next"] = True
@@ -65,7 +144,7 @@ class Chat:
             self.chat_manager.move_to_next_question()
     
         
-        return result
+        yield "result", result
     
     def get_chat_history(self) -> List[dict]:
         return self.chat
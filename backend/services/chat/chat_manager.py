@@ -26,6 +26,67 @@ class ChatManager:
         self.current_child_index = 0  # Index of the current child question being considered
         self.current_child_count = 0
 
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serializable state of the question tree and the position in it.
+        Nodes are listed parents first, core questions first, links are indexes in the list.
+        """
+        nodes = list(self.questions)
+        index = {id(node): i for i, node in enumerate(nodes)}
+        i = 0
+        while i < len(nodes):
+            for linked in (nodes[i].first_child, nodes[i].next_question):
+                if linked is not None and id(linked) not in index:
+                    index[id(linked)] = len(nodes)
+                    nodes.append(linked)
+            i += 1
+
+        def link(node):
+            return index[id(node)] if node is not None else None
+
+        serialized_nodes = []
+        for node in nodes:
+            data = node.to_dict()
+            for key, linked in (("p", node.parent), ("c", node.first_child), ("n", node.next_question)):
+                if linked is not None:
+                    data[key] = link(linked)
+            serialized_nodes.append(data)
+
+        return {
+            "nodes": serialized_nodes,
+            "core": len(self.questions),
+            "current": link(self.current_node),
+            "level": self.level,
+            "total": self.total_questions,
+            "core_index": self.current_core_question_index,
+            "child_index": self.current_child_index,
+            "child_count": self.current_child_count,
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'ChatManager':
+        manager = cls([])
+        nodes = []
+        for data in state["nodes"]:
+            # parents are listed before their children
+            parent = nodes[data["p"]] if "p" in data else None
+            nodes.append(QuestionNode.from_dict(data, parent=parent))
+        for node, data in zip(nodes, state["nodes"]):
+            if "c" in data:
+                node.first_child = nodes[data["c"]]
+            if "n" in data:
+                node.next_question = nodes[data["n"]]
+
+        manager.questions = nodes[:state["core"]]
+        manager.root_question = manager.questions[0] if manager.questions else None
+        manager.current_node = nodes[state["current"]] if state["current"] is not None else None
+        manager.level = state["level"]
+        manager.total_questions = state["total"]
+        manager.current_core_question_index = state["core_index"]
+        manager.current_child_index = state["child_index"]
+        manager.current_child_count = state["child_count"]
+        return manager
+
     def get_current_question(self) -> Optional[QuestionNode]:
         return self.current_node
  
@@ -21,5 +21,6 @@ def build_chat_evaluation_prompt(chat_history):
 
 def evaluate_chat(chat_history):
     prompt = build_chat_evaluation_prompt(chat_history)
-    response = query_chatbot("you're a helpful assistant", prompt)
+    # every chat history is unique, caching it would only evict useful entries
+    response = query_chatbot("you're a helpful assistant", prompt, use_cache=False, prompt_type="evaluate_chat")
     return response
\ No newline at end of file
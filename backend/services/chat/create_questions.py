@@ -1,4 +1,4 @@
-from services.query_chatbot import query_chatbot
+from services.query_chatbot import query_chatbot, query_chatbot_many
 
 
 
@@ -115,11 +115,38 @@ def list_initial_question(text: str, question_count:int) -> list:
     """ 
     print("Generating questions...")
     system_prompt, user_prompt = build_initial_questions_prompt(text, question_count)
-    response = query_chatbot(system_prompt, user_prompt)
-    questions = response.split("\n")
+    response = query_chatbot(system_prompt, user_prompt, prompt_type="list_initial_question")
     print("Questions generated.")
     
-    return list(filter(None, questions))
+    return split_questions(response)
+
+
+def list_section_questions(sections: list, question_count: int) -> list:
+    """
+    Generates candidate questions for each section concurrently.
+    Returns one list of questions per section, empty for a section whose generation failed.
+    """
+    print(f"Generating questions for {len(sections)} sections...")
+    prompts = [build_initial_questions_prompt(section, question_count) for section in sections]
+    responses = query_chatbot_many(prompts, return_exceptions=True, prompt_type="list_section_questions")
+
+    section_questions = []
+    for position, response in enumerate(responses):
+        if isinstance(response, Exception):
+            print(f"Error generating questions for section {position}: {str(response)}")
+            section_questions.append([])
+        else:
+            section_questions.append(split_questions(response))
+    print("Questions generated.")
+
+    return section_questions
+
+
+def split_questions(response: str) -> list:
+    """
+    Splits a chatbot response into its non-empty question lines.
+    """
+    return [line.strip() for line in response.split("\n") if line.strip()]
 
 
 def split_question_from_answer(question: str) -> str: 
@@ -142,5 +169,5 @@ def create_multiple_refinement_questions(current_question, answer, full_evaluati
         )
     )
 
-    multiple_refinement_questions = query_chatbot(system_prompt, user_prompt)
+    multiple_refinement_questions = query_chatbot(system_prompt, user_prompt, prompt_type="create_multiple_refinement_questions")
     return [split_question_from_answer(q)[0] for q in multiple_refinement_questions.split("\n") if q and q.strip() != '']
\ No newline at end of file
@@ -1,4 +1,5 @@
-from services.query_chatbot import query_chatbot
+import json
+from services.query_chatbot import query_chatbot, query_chatbot_stream
 from services.chat.question_node import QuestionNode
 
 
@@ -14,10 +15,8 @@ def get_score_from_chatbot_answer( answer: str) -> str:
     else:
         return "incorrect"
 
-def evaluate_core_answer( current_node: QuestionNode) -> str:
-    """Evaluation of single question and answer"""
-    system_prompt, user_prompt  = build_evaluation_prompt_question_answer(current_node.text, current_node.question, current_node.answer)
-    chatbot_evaluation = query_chatbot(system_prompt, user_prompt )
+def format_core_evaluation(chatbot_evaluation: str) -> tuple[str, str]:
+    """Extract the score of a core question evaluation and reword it for the user."""
     score = get_score_from_chatbot_answer(chatbot_evaluation)
 
     if score == "incorrect":
@@ -35,16 +34,8 @@ def evaluate_core_answer( current_node: QuestionNode) -> str:
         chatbot_evaluation += "\nI'll ask you some more questions to help you get to the right answer."
     return score, chatbot_evaluation
 
-def evaluate_multiple_refinement_answers(current_node: QuestionNode) -> tuple[str, str]:
-    """The same refinement question can only be evaluated twice (i.e. at most with one feedback)"""
-
-    if len(current_node.feedbacks_given) == 0:
-        system_prompt, user_prompt = build_evaluation_prompt_question_answer(current_node.text, current_node.question, current_node.answer)
-    else:
-        system_prompt, user_prompt = build_evaluation_prompt_question_answer_feedback(current_node.text, current_node.question, current_node.answer, current_node.feedbacks_given[0])
-
-    chatbot_evaluation = query_chatbot(system_prompt, user_prompt)
-
+def format_refinement_evaluation(chatbot_evaluation: str) -> tuple[str, str]:
+    """Extract the score of a refinement question evaluation and reword it for the user."""
     score = get_score_from_chatbot_answer(chatbot_evaluation)
 
     # Replace "Wrong" or "wrong" with the new phrase
@@ -58,6 +49,45 @@ def evaluate_multiple_refinement_answers(current_node: QuestionNode) -> tuple[st
 
     return score, chatbot_evaluation
 
+def build_refinement_evaluation_prompt(current_node: QuestionNode) -> tuple[str, str]:
+    """On the second attempt the previous feedback is part of the prompt."""
+    if len(current_node.feedbacks_given) == 0:
+        return build_evaluation_prompt_question_answer(current_node.text, current_node.question, current_node.answer)
+    return build_evaluation_prompt_question_answer_feedback(current_node.text, current_node.question, current_node.answer, current_node.feedbacks_given[0])
+
+def evaluate_core_answer( current_node: QuestionNode) -> str:
+    """Evaluation of single question and answer"""
+    system_prompt, user_prompt  = build_evaluation_prompt_question_answer(current_node.text, current_node.question, current_node.answer)
+    chatbot_evaluation = query_chatbot(system_prompt, user_prompt, prompt_type="evaluate_core_answer")
+    return format_core_evaluation(chatbot_evaluation)
+
+def evaluate_multiple_refinement_answers(current_node: QuestionNode) -> tuple[str, str]:
+    """The same refinement question can only be evaluated twice (i.e. at most with one feedback)"""
+    system_prompt, user_prompt = build_refinement_evaluation_prompt(current_node)
+    chatbot_evaluation = query_chatbot(system_prompt, user_prompt, prompt_type="evaluate_refinement_answers")
+    return format_refinement_evaluation(chatbot_evaluation)
+
+def stream_answer_evaluation(current_node: QuestionNode):
+    """
+    Evaluate the answer of the current node while streaming the evaluator output.
+    Yields ("token", text) as the evaluation is generated, then ("evaluation", (score, full_evaluation)).
+    """
+    if current_node.question_type == "basic":
+        system_prompt, user_prompt = build_evaluation_prompt_question_answer(current_node.text, current_node.question, current_node.answer)
+        format_evaluation = format_core_evaluation
+    elif current_node.question_type == "refinement":
+        system_prompt, user_prompt = build_refinement_evaluation_prompt(current_node)
+        format_evaluation = format_refinement_evaluation
+    else:
+        raise ValueError("Invalid question type for evaluating an answer.")
+
+    tokens = []
+    for token in query_chatbot_stream(system_prompt, user_prompt, prompt_type="evaluate_answer_stream"):
+        tokens.append(token)
+        yield "token", token
+
+    yield "evaluation", format_evaluation("".join(tokens))
+
 
 def build_evaluation_prompt_question_answer(reference_text: str, question: str, answer: str) -> str:
     system_prompt = f"""
@@ -171,3 +201,135 @@ def build_evaluation_prompt_question_answer_feedback( reference_text: str, quest
     
     return system_prompt, user_prompt
 
+SCORES = ["perfect", "correct", "partial", "incorrect"]
+
+COMBINED_EVALUATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "answer_evaluation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "normalized_answer": {"type": "string"},
+                "score": {"type": "string", "enum": SCORES},
+                "feedback": {"type": "string"},
+                "refinement_questions": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["normalized_answer", "score", "feedback", "refinement_questions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def build_combined_evaluation_prompt(reference_text: str, question: str, answer: str, feedback: str = None, ask_refinement_questions: bool = True) -> tuple[str, str]:
+    """Single prompt that rewrites the answer, evaluates it and creates the refinement questions."""
+    refinement_instructions = """
+        4. If the score is "partial" or "incorrect", write in "refinement_questions" the fewest follow-up questions necessary (ideally 1 to 2) to guide the user towards the correct answer of the QUESTION:
+        - Break down the concept asked in the QUESTION into smaller or simpler parts, each part is a question. Don't ask about anything else.
+        - Each question must be answerable alone, with only the user's ANSWER as context, and end with a question mark.
+        - Refer to the user's ANSWER and give hints using the REFERENCE_TEXT, in a simple and encouraging style. Do not include the expected answer.
+        - Otherwise return an empty list.
+    """ if ask_refinement_questions else """
+        4. Always return an empty list in "refinement_questions".
+    """
+
+    second_attempt_context = """
+        This is the user's second attempt at answering the QUESTION, the PREVIOUS_FEEDBACK should guide the evaluation.
+        If all previous suggestions have been addressed, the ANSWER should be scored "correct". Avoid contradicting previous suggestions and repeat any unaddressed suggestions.
+    """ if feedback else ""
+
+    system_prompt = f"""
+    <context>
+        The goal is to evaluate a user's ANSWER against a REFERENCE_TEXT (ground truth) to determine its accuracy and provide feedback. The task focuses on assessing the user's conceptual understanding based on the requirements of the original QUESTION.
+        {second_attempt_context}
+    </context>
+
+    <objective>
+        1. Write in "normalized_answer" the user's ANSWER with fixed grammar, punctuation and spelling, and clarified references (e.g., replace "it" with the specific subject). Do not add new information, never complete or correct an unfinished or incorrect answer.
+        2. Score the normalized answer in "score":
+        - **perfect**: The answer fully meets the QUESTION's requirements and demonstrates excellent understanding.
+        - **correct**: The answer shows good understanding of the key concepts, details are not required.
+        - **partial**: The answer shows some understanding but lacks key elements.
+        - **incorrect**: The answer completely misinterprets the REFERENCE_TEXT, ignores key concepts, or introduces irrelevant or incorrect information.
+        3. Write in "feedback":
+        - For "partial" or "incorrect": one or two concise, actionable bullet points in an HTML unordered list, each beginning with an action verb. Do not reveal the answer.
+        - For "correct" or "perfect": an empty string.
+        {refinement_instructions}
+    </objective>
+
+    <instructions>
+        - To be scored **correct**, the answer only needs to address the core concepts accurately.
+        - Focus on understanding of the content rather than exact wording. Be flexible with terminology and synonyms.
+        - Disregard writing style, grammar, or typos; focus on content accuracy.
+    </instructions>
+
+    <tone>
+        The tone should be constructive and encouraging. The feedback is intended for learners who are not expected to have read the REFERENCE_TEXT beforehand.
+    </tone>
+    """
+
+    previous_feedback = f"<PREVIOUS_FEEDBACK>{feedback}</PREVIOUS_FEEDBACK>" if feedback else ""
+    user_prompt = f"""
+    <REFERENCE_TEXT>{reference_text}</REFERENCE_TEXT>
+    <QUESTION>{question}</QUESTION>
+    {previous_feedback}
+    <ANSWER>{answer}</ANSWER>
+    """
+    return system_prompt, user_prompt
+
+
+def format_structured_evaluation(question_type: str, score: str, feedback: str) -> str:
+    """Build the same user facing evaluation text as format_core_evaluation and format_refinement_evaluation."""
+    labels = {
+        "perfect": "Perfect",
+        "correct": "Correct",
+        "partial": "Partially correct, here are some suggestions for improvement",
+        "incorrect": "Incorrect, here are some suggestions for improvement",
+    }
+    evaluation = labels[score]
+    if feedback:
+        evaluation += "\n" + feedback
+    if question_type == "basic" and score in ("incorrect", "partial"):
+        evaluation += "\nI'll ask you some more questions to help you get to the right answer."
+    return evaluation
+
+
+def evaluate_answer_combined(current_node: QuestionNode, answer: str) -> dict:
+    """
+    Rewrite, evaluate and create the refinement questions for an answer with a single chatbot call.
+    Returns a dict with "answer", "score", "feedback" and "refinement_questions",
+    raises ValueError if the chatbot response doesn't match the schema.
+    """
+    previous_feedback = None
+    if current_node.question_type == "refinement" and current_node.feedbacks_given:
+        previous_feedback = current_node.feedbacks_given[0]
+
+    system_prompt, user_prompt = build_combined_evaluation_prompt(
+        current_node.text,
+        current_node.question,
+        answer,
+        feedback=previous_feedback,
+        ask_refinement_questions=current_node.question_type == "basic"
+    )
+    response = query_chatbot(system_prompt, user_prompt, response_format=COMBINED_EVALUATION_RESPONSE_FORMAT, prompt_type="evaluate_answer_combined")
+
+    try:
+        evaluation = json.loads(response)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid evaluation response: {str(e)}")
+    if not isinstance(evaluation, dict) or evaluation.get("score") not in SCORES:
+        raise ValueError("Invalid evaluation response: missing or unknown score")
+
+    score = evaluation["score"]
+    refinement_questions = []
+    if score in ("partial", "incorrect"):
+        refinement_questions = [q.strip() for q in evaluation.get("refinement_questions") or [] if q and q.strip()]
+
+    return {
+        "answer": evaluation.get("normalized_answer") or answer,
+        "score": score,
+        "feedback": format_structured_evaluation(current_node.question_type, score, (evaluation.get("feedback") or "").strip()),
+        "refinement_questions": refinement_questions,
+    }
@@ -100,6 +100,25 @@ class QuestionNode:
         return "/n".join(siblings_questions)
 
 
+    def to_dict(self) -> dict:
+        """Fields of the node without its links, see ChatManager.to_dict for the tree."""
+        data = {"q": self.question, "type": self.question_type}
+        # refinement questions share the reference text of their parent, it is only stored once
+        if not self.parent or self.text != self.parent.text:
+            data["x"] = self.text
+        if self.answer is not None:
+            data["a"] = self.answer
+        if self.feedbacks_given:
+            data["f"] = self.feedbacks_given
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, parent: Optional['QuestionNode'] = None) -> 'QuestionNode':
+        text = data["x"] if "x" in data else parent.text
+        node = cls(text, data["q"], question_type=data["type"], answer=data.get("a"), parent=parent)
+        node.feedbacks_given = list(data.get("f", []))
+        return node
+
     def __deepcopy__(self, memo):
         """Create a deep copy of the current QuestionNode, including its hierarchy."""
         # Create a new instance of QuestionNode with the same basic attributes
@@ -1,4 +1,4 @@
-from services.query_chatbot import query_chatbot
+from services.query_chatbot import query_chatbot, query_chatbot_stream
 from services.chat.question_node import QuestionNode
 
 
@@ -39,7 +39,7 @@ def build_rewrite_user_answer_prompt(question, answer) -> str:
 
 def rewrite_answer(question, answer): 
     system_prompt, user_prompt = build_rewrite_user_answer_prompt(question, answer)
-    response = query_chatbot(system_prompt, user_prompt)
+    response = query_chatbot(system_prompt, user_prompt, prompt_type="rewrite_answer")
     return response
  
 
@@ -79,5 +79,11 @@ def build_rewrite_hint_prompt(question, answer, reference) -> str:
 
 def rewrite_hint(question, answer, reference_text): 
     system_prompt, user_prompt = build_rewrite_hint_prompt(question, answer, reference_text)
-    response = query_chatbot(system_prompt, user_prompt)
-    return response
\ No newline at end of file
+    response = query_chatbot(system_prompt, user_prompt, prompt_type="rewrite_hint")
+    return response
+
+
+def rewrite_hint_stream(question, answer, reference_text):
+    """Yield the hint text as it is generated."""
+    system_prompt, user_prompt = build_rewrite_hint_prompt(question, answer, reference_text)
+    yield from query_chatbot_stream(system_prompt, user_prompt, prompt_type="rewrite_hint")
@@ -0,0 +1,220 @@
+"""
+Persistent cache of the embeddings of document chunks, wrapped around the embedding model of llama_index.
+Documents are only embedded when they are indexed, with QUESTION_GENERATION_MODE=whole_document:
+the default map_reduce mode does not use the cache.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+from config import Config
+
+
+def make_embedding_key(model_name: str, kind: str, text: str) -> str:
+    """Key of an embedding: the model, the kind of input (text or query) and the hash of the text."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model_name}:{kind}:{digest}"
+
+
+class EmbeddingStore:
+    """
+    Persistent embedding vectors in a local SQLite file, stored as float32 blobs.
+    Embeddings of a text never change for a given model, so entries do not expire and the
+    least recently used ones are only pruned above max_entries.
+    """
+
+    # prune overflowing rows every N writes instead of on every write
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections must not be shared with forked worker processes
+        if self._connection is None or self._connection_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Return the stored vectors of the keys found, by key."""
+        if not keys:
+            return {}
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            placeholders = ",".join("?" * len(keys))
+            rows = connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            if rows:
+                connection.execute(
+                    f"UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})", [now, *keys]
+                )
+                connection.commit()
+        vectors = {}
+        for key, blob in rows:
+            vector = array("f")
+            vector.frombytes(blob)
+            vectors[key] = vector.tolist()
+        return vectors
+
+    def set_many(self, items: dict) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            self._writes += len(rows)
+            if self._writes >= self.PRUNE_EVERY:
+                self._writes = 0
+                connection.execute(
+                    """
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+            connection.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model that serves the embeddings already computed from the embedding store
+    and only sends the texts it has never seen to the wrapped model.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+    _stats_lock: Any = PrivateAttr()
+    _counters: dict = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, store: EmbeddingStore, **kwargs: Any):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._store = store
+        self._stats_lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "errors": 0}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._counters[name] += amount
+
+    def _lookup(self, kind: str, texts: List[str]) -> tuple:
+        """Return the keys of the texts and the vectors already stored."""
+        keys = [make_embedding_key(self.model_name, kind, text) for text in texts]
+        try:
+            cached = self._store.get_many(list(set(keys)))
+        except sqlite3.Error as e:
+            print(f"Error reading embedding cache: {str(e)}")
+            self._count("errors")
+            cached = {}
+        return keys, cached
+
+    def _missing(self, keys: List[str], texts: List[str], cached: dict) -> dict:
+        """Return the texts to embed by key, each distinct text only once."""
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self._count("hits", len(texts) - len(missing))
+        self._count("misses", len(missing))
+        return missing
+
+    def _merge(self, keys: List[str], cached: dict, missing: dict, embeddings: List[Embedding]) -> List[Embedding]:
+        """Store the new embeddings and return the embeddings of all the texts in order."""
+        new_vectors = dict(zip(missing.keys(), embeddings))
+        try:
+            self._store.set_many(new_vectors)
+        except sqlite3.Error as e:
+            print(f"Error writing embedding cache: {str(e)}")
+            self._count("errors")
+        vectors = {**cached, **new_vectors}
+        return [vectors[key] for key in keys]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, cached = self._lookup("text", texts)
+        missing = self._missing(keys, texts, cached)
+        embeddings = self._embed_model._get_text_embeddings(list(missing.values())) if missing else []
+        return self._merge(keys, cached, missing, embeddings)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, cached = self._lookup("text", texts)
+        missing = self._missing(keys, texts, cached)
+        embeddings = await self._embed_model._aget_text_embeddings(list(missing.values())) if missing else []
+        return self._merge(keys, cached, missing, embeddings)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        keys, cached = self._lookup("query", [query])
+        missing = self._missing(keys, [query], cached)
+        embeddings = [self._embed_model._get_query_embedding(query)] if missing else []
+        return self._merge(keys, cached, missing, embeddings)[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        keys, cached = self._lookup("query", [query])
+        missing = self._missing(keys, [query], cached)
+        embeddings = [await self._embed_model._aget_query_embedding(query)] if missing else []
+        return self._merge(keys, cached, missing, embeddings)[0]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def with_embedding_cache(embed_model: BaseEmbedding) -> BaseEmbedding:
+    """Wrap the embedding model with the persistent embedding cache, unless it is disabled."""
+    if not Config.EMBEDDING_CACHE_ENABLED or not Config.EMBEDDING_CACHE_DB_PATH:
+        return embed_model
+    store = EmbeddingStore(Config.EMBEDDING_CACHE_DB_PATH, Config.EMBEDDING_CACHE_MAX_ENTRIES)
+    return CachedEmbedding(embed_model, store)
@@ -0,0 +1,33 @@
+"""
+Celery worker for ingestion jobs, used when JOB_QUEUE_BACKEND=celery.
+
+    celery -A services.jobs.celery_app worker --concurrency 2
+"""
+import base64
+
+from celery import Celery
+from celery.signals import worker_process_init
+from config import Config
+from services.jobs.ingestion import run_ingestion_job
+
+celery_app = Celery("questudy", broker=Config.CELERY_BROKER_URL)
+celery_app.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    task_ignore_result=True,
+    # ingestion jobs are long, only take the next one once the current one is finished
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+)
+
+
+@worker_process_init.connect
+def load_ingestion_stack(**kwargs):
+    """Load the llama_index stack when a worker process starts, not when it runs its first job"""
+    import services.process_and_chunk_pdf.process_pdf_workflow  # noqa: F401
+
+
+@celery_app.task(name="ingest_files")
+def ingest_files(job_id, encoded_files, question_count, regenerate=False):
+    files = [base64.b64decode(encoded_file) for encoded_file in encoded_files]
+    run_ingestion_job(job_id, files, question_count, regenerate)
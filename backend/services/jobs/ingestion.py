@@ -0,0 +1,113 @@
+import base64
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import Config
+from models.job import Job
+from models.quiz import Quiz
+from services.tracing import trace, span
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def run_ingestion_job(job_id: str, files: list, question_count: int, regenerate: bool = False) -> None:
+    """Process the files of an ingestion job, the generated chunks are stored as a quiz whose id is the job result."""
+    # a trace of its own, the job outlives the upload request
+    with trace("ingestion job", job_id=job_id, files=len(files), question_count=question_count):
+        process_files(job_id, files, question_count, regenerate)
+
+
+def process_files(job_id: str, files: list, question_count: int, regenerate: bool) -> None:
+    last_stage = None
+
+    if not Job.start_job(job_id):
+        print(f"Ingestion job {job_id} is not queued anymore, skipping it")
+        return
+
+    try:
+        # the llama_index stack takes seconds and a lot of memory to load, only processes running jobs load it
+        with span("load_ingestion_stack"):
+            from services.process_and_chunk_pdf.process_pdf_workflow import divide_dataset_in_sections
+
+        chunks = []
+        for index, file_data in enumerate(files):
+            def report_progress(stage, file_progress, failed_questions=0):
+                # overall progress over all the files of the job
+                nonlocal last_stage
+                Job.update_progress(
+                    job_id, stage, (index + file_progress) / len(files),
+                    new_stage=stage != last_stage, failed_questions=failed_questions
+                )
+                last_stage = stage
+
+            with span("process_file", file_index=index, bytes=len(file_data)):
+                content = divide_dataset_in_sections(
+                    file_data, question_count, progress_callback=report_progress, regenerate=regenerate
+                )
+            if content:
+                chunks.extend(content)
+
+        if not chunks:
+            Job.fail_job(job_id, "No content could be extracted from the files")
+            return
+        quiz_id = Quiz.create_quiz(chunks, question_count)
+        if not Job.complete_job(job_id, {"quiz_id": quiz_id}):
+            print(f"Ingestion job {job_id} was failed while it was processed")
+    except Exception as e:
+        print(f"Error in ingestion job {job_id}: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        Job.fail_job(job_id, "Failed to process file content")
+
+
+def get_executor(broken=None):
+    """Executor of the local job backends, broken is a process pool to replace after one of its processes died"""
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor is broken:
+            if Config.JOB_QUEUE_BACKEND == "process":
+                # fresh interpreters, not forks of a (gevent patched) web worker: parsing and indexing files
+                # is CPU bound, in the web worker it would block every other request it serves
+                _executor = ProcessPoolExecutor(
+                    max_workers=Config.INGESTION_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                _executor = ThreadPoolExecutor(max_workers=Config.INGESTION_WORKERS, thread_name_prefix="ingestion")
+        return _executor
+
+
+def fail_if_crashed(job_id: str, future) -> None:
+    """run_ingestion_job handles its errors, an exception here means the process running it died"""
+    error = future.exception()
+    if error is not None:
+        print(f"Ingestion job {job_id} crashed: {type(error).__name__}: {str(error)}")
+        Job.fail_job(job_id, "Failed to process file content")
+
+
+def submit_ingestion_job(user_id: str, files: list, question_count: int, regenerate: bool = False) -> str:
+    """
+    Queue the processing of the uploaded files and return the job id to poll.
+    With regenerate, new questions are generated even for files already in the question bank.
+    """
+    job_id = Job.create_job(
+        user_id, "ingestion", {"question_count": question_count, "file_count": len(files), "regenerate": regenerate}
+    )
+
+    if Config.JOB_QUEUE_BACKEND == "celery":
+        from services.jobs.celery_app import ingest_files
+
+        encoded_files = [base64.b64encode(file_data).decode("ascii") for file_data in files]
+        ingest_files.delay(job_id, encoded_files, question_count, regenerate)
+    else:
+        # local backends: a pool of processes or threads of the web worker, the request returns right away
+        executor = get_executor()
+        try:
+            future = executor.submit(run_ingestion_job, job_id, files, question_count, regenerate)
+        except BrokenProcessPool:
+            future = get_executor(broken=executor).submit(run_ingestion_job, job_id, files, question_count, regenerate)
+        future.add_done_callback(lambda done: fail_if_crashed(job_id, done))
+
+    return job_id
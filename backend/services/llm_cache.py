@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import Config
+
+
+def make_cache_key(model: str, messages: list, params: Optional[dict] = None) -> str:
+    """Build a content-addressed key from the model, the messages and the request params."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params or {}},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Bounded in-process cache, evicts the least recently used entry and expired entries."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, stored_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at or time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteCache:
+    """Persistent cache tier stored in a local SQLite file, shared by all the workers of a host."""
+
+    # prune expired and overflowing rows every N writes instead of on every write
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections must not be shared with forked worker processes
+        if self._connection is None or self._connection_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (created_at, value) or None if the key is missing or expired."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT created_at, value FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                connection.commit()
+            return row
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(connection, now)
+            connection.commit()
+
+    def _prune(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        connection.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for chatbot responses: an in-memory LRU in front of a persistent SQLite tier.
+    Hits on the persistent tier are promoted to memory.
+    """
+
+    def __init__(self, memory: LRUCache, persistent: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.persistent = persistent
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        if self.persistent is not None:
+            try:
+                row = self.persistent.get(key)
+            except sqlite3.Error as e:
+                print(f"Error reading response cache: {str(e)}")
+                self._count("errors")
+                row = None
+            if row is not None:
+                created_at, value = row
+                self.memory.set(key, value, stored_at=created_at)
+                self._count("persistent_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, value)
+            except sqlite3.Error as e:
+                print(f"Error writing response cache: {str(e)}")
+                self._count("errors")
+        self._count("stores")
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        hits = stats["memory_hits"] + stats["persistent_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_ratio"] = hits / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if caching is disabled."""
+    global _response_cache
+    if not Config.LLM_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                persistent = None
+                if Config.LLM_CACHE_DB_PATH:
+                    persistent = SQLiteCache(
+                        Config.LLM_CACHE_DB_PATH,
+                        Config.LLM_CACHE_DB_MAX_ENTRIES,
+                        Config.LLM_CACHE_TTL_SECONDS,
+                    )
+                _response_cache = ResponseCache(
+                    LRUCache(Config.LLM_CACHE_MAX_ENTRIES, Config.LLM_CACHE_TTL_SECONDS),
+                    persistent,
+                )
+    return _response_cache
@@ -0,0 +1,136 @@
+"""
+Process-wide registry of OpenAI clients.
+
+All chatbot traffic goes through the clients returned here so that HTTP connections
+(and their TLS sessions) are pooled and kept alive between requests.
+"""
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from config import Config
+from services.llm_rate_limiter import RateLimitedTransport
+from services.metrics import observe_llm_tokens
+
+_lock = threading.Lock()
+_pid = None
+_sync_http_client = None
+_rate_limited_http_clients = {}  # prompt type -> httpx.Client
+_sync_client = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+_background_loop = None
+
+
+def _build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=Config.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _build_timeout() -> httpx.Timeout:
+    return httpx.Timeout(Config.LLM_REQUEST_TIMEOUT, connect=Config.LLM_CONNECT_TIMEOUT)
+
+
+def _reset_after_fork() -> None:
+    """Pooled connections can't be shared with forked worker processes, start over in a new process."""
+    global _pid, _sync_http_client, _rate_limited_http_clients, _sync_client, _async_clients, _background_loop
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _sync_http_client = None
+        _rate_limited_http_clients = {}
+        _sync_client = None
+        _async_clients = weakref.WeakKeyDictionary()
+        _background_loop = None
+
+
+def get_sync_http_client() -> httpx.Client:
+    """Shared pooled HTTP client of the OpenAI clients below."""
+    global _sync_http_client
+    with _lock:
+        _reset_after_fork()
+        if _sync_http_client is None:
+            _sync_http_client = DefaultHttpxClient(limits=_build_limits(), timeout=_build_timeout())
+        return _sync_http_client
+
+
+def get_rate_limited_http_client(prompt_type: str) -> httpx.Client:
+    """
+    Pooled HTTP client whose requests are admitted by the rate limiter, handed to the llama_index OpenAI
+    wrappers, which call the API themselves instead of going through query_chatbot.
+    The tokens of its responses are counted under prompt_type in the metrics.
+    """
+    with _lock:
+        _reset_after_fork()
+        if prompt_type not in _rate_limited_http_clients:
+            _rate_limited_http_clients[prompt_type] = DefaultHttpxClient(
+                transport=RateLimitedTransport(
+                    httpx.HTTPTransport(limits=_build_limits()),
+                    on_usage=lambda usage: observe_llm_tokens(
+                        prompt_type, usage.get("prompt_tokens"), usage.get("completion_tokens")
+                    ),
+                ),
+                timeout=_build_timeout(),
+            )
+        return _rate_limited_http_clients[prompt_type]
+
+
+def get_sync_client() -> OpenAI:
+    global _sync_client
+    http_client = get_sync_http_client()
+    with _lock:
+        if _sync_client is None:
+            _sync_client = OpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                max_retries=0,  # retries are handled by services.llm_rate_limiter
+                timeout=_build_timeout(),
+                http_client=http_client,
+            )
+        return _sync_client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    AsyncOpenAI client for the running event loop.
+    Async connections are bound to the loop that opened them, so there is one client per loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _reset_after_fork()
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                max_retries=0,  # retries are handled by services.llm_rate_limiter
+                timeout=_build_timeout(),
+                http_client=DefaultAsyncHttpxClient(limits=_build_limits(), timeout=_build_timeout()),
+            )
+            _async_clients[loop] = client
+        return client
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    with _lock:
+        _reset_after_fork()
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+            thread.start()
+            _background_loop = loop
+        return _background_loop
+
+
+def run_coroutine(coroutine):
+    """
+    Run a coroutine from synchronous code (e.g. a Flask view) and wait for its result.
+    Coroutines run on a long-lived background loop so its async client keeps its connections alive.
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, _get_background_loop())
+    return future.result()
@@ -0,0 +1,540 @@
+"""
+Admission control for outbound chatbot calls.
+
+Requests-per-minute and tokens-per-minute budgets are enforced with token buckets whose state is
+shared by every thread and worker process: in a file guarded by a file lock (one host), in Redis
+(several hosts) or in memory (single process stand-in). Concurrent calls are capped with lock-file
+slots, which the OS releases if a worker dies. Rate limited and transient errors are retried with
+jittered exponential backoff that honors Retry-After.
+
+Calls made with query_chatbot go through call_with_rate_limit (or its async and streaming variants),
+the calls llama_index makes itself (reranking, embeddings) through RateLimitedTransport.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+import openai
+from config import Config
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call waited longer than LLM_RATE_LIMIT_MAX_WAIT to be admitted."""
+
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.InternalServerError,
+)
+
+
+def take_from_buckets(state: dict, buckets: list, now: float, force: bool = False) -> float:
+    """
+    Refill the buckets and take the requested amounts if all of them have enough, otherwise leave them untouched.
+    buckets is a list of (name, capacity, refill_per_second, amount), state maps name -> [level, updated_at].
+    Returns the number of seconds to wait before the amounts are available (0 if they were taken).
+    With force the amounts are taken anyway, possibly leaving a bucket in debt.
+    """
+    levels = {}
+    wait = 0.0
+    for name, capacity, rate, amount in buckets:
+        level, updated_at = state.get(name, (capacity, now))
+        level = min(capacity, level + max(0.0, now - updated_at) * rate)
+        levels[name] = level
+        if level < amount:
+            wait = max(wait, (amount - level) / rate)
+
+    if wait > 0 and not force:
+        return wait
+    for name, capacity, rate, amount in buckets:
+        state[name] = [levels[name] - amount, now]
+    return 0.0
+
+
+class MemoryBucketStore:
+    """Bucket state of the current process only, stand-in when no shared store is available."""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets: list, force: bool = False) -> float:
+        with self._lock:
+            return take_from_buckets(self._state, buckets, time.time(), force)
+
+
+class FileBucketStore:
+    """Bucket state in a JSON file guarded by an exclusive file lock, shared by the workers of a host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def take(self, buckets: list, force: bool = False) -> float:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    state = {}
+                wait = take_from_buckets(state, buckets, time.time(), force)
+                if wait == 0:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisBucketStore:
+    """Bucket state in Redis, updated atomically by a Lua script, shared by every host."""
+
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local force = ARGV[2] == '1'
+    local levels = {}
+    local wait = 0
+    for i = 1, #KEYS do
+        local capacity = tonumber(ARGV[3 + (i - 1) * 3])
+        local rate = tonumber(ARGV[4 + (i - 1) * 3])
+        local amount = tonumber(ARGV[5 + (i - 1) * 3])
+        local state = redis.call('HMGET', KEYS[i], 'level', 'updated_at')
+        local level = tonumber(state[1]) or capacity
+        local updated_at = tonumber(state[2]) or now
+        level = math.min(capacity, level + math.max(0, now - updated_at) * rate)
+        levels[i] = level
+        if level < amount then
+            wait = math.max(wait, (amount - level) / rate)
+        end
+    end
+    if wait > 0 and not force then
+        return tostring(wait)
+    end
+    for i = 1, #KEYS do
+        local amount = tonumber(ARGV[5 + (i - 1) * 3])
+        redis.call('HSET', KEYS[i], 'level', levels[i] - amount, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[i], 300)
+    end
+    return '0'
+    """
+
+    def __init__(self, url: str, prefix: str = "llm_rate_limit:"):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    def take(self, buckets: list, force: bool = False) -> float:
+        keys = [self.prefix + name for name, _, _, _ in buckets]
+        args = [time.time(), "1" if force else "0"]
+        for _, capacity, rate, amount in buckets:
+            args.extend([capacity, rate, amount])
+        return float(self._script(keys=keys, args=args))
+
+
+class ConcurrencySlots:
+    """
+    At most `count` calls in flight across the workers of a host, one lock file per slot.
+    Without a directory the limit only applies to the current process.
+    """
+
+    def __init__(self, count: int, directory: Optional[str] = None):
+        self.count = count
+        self.directory = directory
+        self._semaphore = None if directory else threading.BoundedSemaphore(count)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self):
+        """Return a slot handle, or None if every slot is taken."""
+        if self._semaphore is not None:
+            return True if self._semaphore.acquire(blocking=False) else None
+
+        for index in random.sample(range(self.count), self.count):
+            f = open(os.path.join(self.directory, f"slot-{index}.lock"), "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    def release(self, slot) -> None:
+        if self._semaphore is not None:
+            self._semaphore.release()
+        else:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+
+
+class LLMRateLimiter:
+    """Blocks callers until a concurrency slot and the request and token budgets are available."""
+
+    # longest single sleep between two admission attempts
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, store, requests_per_minute: int, tokens_per_minute: int, slots: ConcurrencySlots, max_wait: float):
+        self.store = store
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.slots = slots
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._counters = {
+            "admitted": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _buckets(self, tokens: int) -> list:
+        return [
+            ("requests", self.requests_per_minute, self.requests_per_minute / 60, 1),
+            # a prompt larger than the whole budget would never be admitted
+            ("tokens", self.tokens_per_minute, self.tokens_per_minute / 60, min(tokens, self.tokens_per_minute)),
+        ]
+
+    def _try_admit(self, tokens: int):
+        """Return (slot, 0) once admitted or (None, seconds to wait)."""
+        slot = self.slots.try_acquire()
+        if slot is None:
+            return None, self.POLL_INTERVAL
+        try:
+            wait = self.store.take(self._buckets(tokens))
+        except Exception:
+            self.slots.release(slot)
+            raise
+        if wait > 0:
+            self.slots.release(slot)
+            return None, min(wait, self.POLL_INTERVAL)
+        return slot, 0
+
+    def _start_waiting(self) -> float:
+        with self._lock:
+            self._waiting += 1
+        return time.monotonic()
+
+    def _stop_waiting(self, started_at: float, admitted: bool) -> None:
+        waited = time.monotonic() - started_at
+        with self._lock:
+            self._waiting -= 1
+            self._counters["admitted" if admitted else "timeouts"] += 1
+            self._counters["wait_seconds_total"] += waited
+            self._counters["wait_seconds_max"] = max(self._counters["wait_seconds_max"], waited)
+
+    def acquire(self, tokens: int):
+        started_at = self._start_waiting()
+        admitted = False
+        try:
+            while True:
+                slot, wait = self._try_admit(tokens)
+                if slot is not None:
+                    admitted = True
+                    return slot
+                if time.monotonic() - started_at + wait > self.max_wait:
+                    raise RateLimitTimeout(f"Chatbot call not admitted within {self.max_wait}s")
+                time.sleep(wait)
+        finally:
+            self._stop_waiting(started_at, admitted)
+
+    async def acquire_async(self, tokens: int):
+        started_at = self._start_waiting()
+        admitted = False
+        try:
+            while True:
+                # the lock files and the Redis round trip block, they must not stall the event loop
+                slot, wait = await asyncio.to_thread(self._try_admit, tokens)
+                if slot is not None:
+                    admitted = True
+                    return slot
+                if time.monotonic() - started_at + wait > self.max_wait:
+                    raise RateLimitTimeout(f"Chatbot call not admitted within {self.max_wait}s")
+                await asyncio.sleep(wait)
+        finally:
+            self._stop_waiting(started_at, admitted)
+
+    def release(self, slot) -> None:
+        self.slots.release(slot)
+
+    def record_usage(self, estimated_tokens: int, used_tokens: Optional[int]) -> None:
+        """Charge the token budget for tokens used beyond the estimate."""
+        if used_tokens is not None and used_tokens > estimated_tokens:
+            self.store.take([("tokens", self.tokens_per_minute, self.tokens_per_minute / 60, used_tokens - estimated_tokens)], force=True)
+
+    def record_retry(self, error: Optional[Exception], rate_limited: bool = False) -> None:
+        with self._lock:
+            self._counters["retries"] += 1
+            if rate_limited or isinstance(error, openai.RateLimitError):
+                self._counters["rate_limited"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["queue_depth"] = self._waiting
+        calls = stats["admitted"] + stats["timeouts"]
+        stats["wait_seconds_mean"] = stats["wait_seconds_total"] / calls if calls else 0.0
+        return stats
+
+
+def estimate_tokens(messages: list) -> int:
+    """Rough token count of a request: ~4 characters per prompt token plus the expected completion."""
+    prompt_characters = sum(len(message.get("content") or "") for message in messages)
+    return prompt_characters // 4 + Config.LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Full jitter exponential backoff, never shorter than the Retry-After the API asked for."""
+    return backoff_delay(attempt, getattr(error, "response", None))
+
+
+def backoff_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    delay = random.uniform(0, min(Config.LLM_RETRY_MAX_DELAY, Config.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    headers = response.headers if response is not None else {}
+    retry_after = None
+    try:
+        if headers.get("retry-after-ms"):
+            retry_after = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            retry_after = float(headers["retry-after"])
+    except ValueError:
+        # Retry-After can also be an HTTP date, fall back to the backoff
+        retry_after = None
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, Config.LLM_RETRY_MAX_DELAY))
+    return delay
+
+
+def _used_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def call_with_rate_limit(request, messages: list):
+    """
+    Run request() once admitted by the rate limiter, retrying rate limited and transient errors.
+    Errors are retried even when rate limiting is disabled.
+    """
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(messages)
+    attempt = 0
+    while True:
+        slot = limiter.acquire(estimated_tokens) if limiter else None
+        try:
+            response = request()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= Config.LLM_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, e)
+            print(f"Chatbot call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            if limiter:
+                limiter.record_retry(e)
+            attempt += 1
+        else:
+            if limiter:
+                limiter.record_usage(estimated_tokens, _used_tokens(response))
+            return response
+        finally:
+            if limiter:
+                limiter.release(slot)
+        time.sleep(delay)
+
+
+async def call_with_rate_limit_async(request, messages: list):
+    """Async variant of call_with_rate_limit, request() must return an awaitable."""
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(messages)
+    attempt = 0
+    while True:
+        slot = await limiter.acquire_async(estimated_tokens) if limiter else None
+        try:
+            response = await request()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= Config.LLM_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, e)
+            print(f"Chatbot call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            if limiter:
+                limiter.record_retry(e)
+            attempt += 1
+        else:
+            if limiter:
+                await asyncio.to_thread(limiter.record_usage, estimated_tokens, _used_tokens(response))
+            return response
+        finally:
+            if limiter:
+                limiter.release(slot)
+        await asyncio.sleep(delay)
+
+
+def stream_with_rate_limit(request, messages: list):
+    """
+    Streaming variant of call_with_rate_limit, yields the chunks of the stream returned by request().
+    The concurrency slot is held until the stream is exhausted or closed, and the token budget is
+    charged with the usage of the last chunk (requested with stream_options include_usage).
+    Errors are only retried before the first chunk, a stream can't be resumed.
+    """
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(messages)
+    attempt = 0
+    while True:
+        slot = limiter.acquire(estimated_tokens) if limiter else None
+        stream = None
+        started = False
+        used_tokens = None
+        try:
+            stream = request()
+            for chunk in stream:
+                started = True
+                if getattr(chunk, "usage", None) is not None:
+                    used_tokens = chunk.usage.total_tokens
+                yield chunk
+            if limiter:
+                limiter.record_usage(estimated_tokens, used_tokens)
+            return
+        except RETRYABLE_ERRORS as e:
+            if started or attempt >= Config.LLM_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, e)
+            print(f"Chatbot call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            if limiter:
+                limiter.record_retry(e)
+            attempt += 1
+        finally:
+            # also run when the caller stops reading, the connection is released with the slot
+            if stream is not None:
+                stream.close()
+            if limiter:
+                limiter.release(slot)
+        time.sleep(delay)
+
+
+# statuses retried by the OpenAI client
+RETRYABLE_STATUSES = {408, 409, 429}
+
+
+def estimate_request_tokens(request: httpx.Request) -> int:
+    """Token estimate of a raw API request: chat messages or embedding inputs."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except ValueError:
+        return Config.LLM_COMPLETION_TOKENS_ESTIMATE
+    if "messages" in body:
+        return estimate_tokens(body["messages"])
+    inputs = body.get("input", "")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    return sum(len(text) for text in inputs if isinstance(text, str)) // 4
+
+
+def _response_usage(response: httpx.Response) -> dict:
+    """Usage object of an API response as a dict, empty if it has none"""
+    try:
+        return response.json().get("usage") or {}
+    except (ValueError, AttributeError):
+        return {}
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    HTTP transport admitting every request through the rate limiter, for the clients that libraries
+    call the API with themselves (the llama_index OpenAI LLM used by the reranker, the embeddings).
+    Rate limited and transient failures are retried here like in call_with_rate_limit, so these clients
+    must be built with max_retries=0. on_usage is called with the usage of every successful response.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, on_usage=None):
+        self._transport = transport
+        self._on_usage = on_usage
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = get_rate_limiter()
+        estimated_tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            slot = limiter.acquire(estimated_tokens) if limiter else None
+            error = None
+            response = None
+            try:
+                response = self._transport.handle_request(request)
+                response.read()
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                if limiter:
+                    limiter.release(slot)
+
+            if response is not None and response.status_code not in RETRYABLE_STATUSES and response.status_code < 500:
+                if response.is_success:
+                    usage = _response_usage(response)
+                    if limiter:
+                        limiter.record_usage(estimated_tokens, usage.get("total_tokens"))
+                    if self._on_usage is not None and usage:
+                        self._on_usage(usage)
+                return response
+            if attempt >= Config.LLM_MAX_RETRIES:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = backoff_delay(attempt, response)
+            failure = type(error).__name__ if error is not None else f"HTTP {response.status_code}"
+            print(f"Chatbot call failed ({failure}), retrying in {delay:.1f}s")
+            if limiter:
+                limiter.record_retry(error, rate_limited=response is not None and response.status_code == 429)
+            if response is not None:
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def build_bucket_store():
+    if Config.LLM_RATE_LIMIT_BACKEND == "redis":
+        return RedisBucketStore(Config.LLM_RATE_LIMIT_REDIS_URL)
+    if Config.LLM_RATE_LIMIT_BACKEND == "file":
+        return FileBucketStore(os.path.join(Config.LLM_RATE_LIMIT_STATE_DIR, "buckets.json"))
+    return MemoryBucketStore()
+
+
+def get_rate_limiter() -> Optional[LLMRateLimiter]:
+    """Return the process-wide rate limiter, or None if rate limiting is disabled."""
+    global _rate_limiter
+    if not Config.LLM_RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                slots_directory = None
+                if Config.LLM_RATE_LIMIT_BACKEND in ("file", "redis"):
+                    slots_directory = os.path.join(Config.LLM_RATE_LIMIT_STATE_DIR, "slots")
+                _rate_limiter = LLMRateLimiter(
+                    build_bucket_store(),
+                    Config.LLM_REQUESTS_PER_MINUTE,
+                    Config.LLM_TOKENS_PER_MINUTE,
+                    ConcurrencySlots(Config.LLM_MAX_CONCURRENT_REQUESTS, slots_directory),
+                    Config.LLM_RATE_LIMIT_MAX_WAIT,
+                )
+    return _rate_limiter
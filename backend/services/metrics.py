@@ -0,0 +1,145 @@
+"""
+Prometheus metrics of the backend, served at /metrics.
+
+- http_request_duration_seconds: latency per route (the URL rule, not the URL), method and status.
+- llm_request_duration_seconds, llm_tokens_total, llm_errors_total, llm_cache_hits_total: chatbot calls per
+  prompt type, the call sites pass their prompt type to query_chatbot. The reranking and embedding calls
+  of llama_index count their tokens in their HTTP client (services.llm_clients.get_rate_limited_http_client).
+- mongo_command_duration_seconds, mongo_command_errors_total: per collection and command, fed by the
+  command listener of models.db.
+- quiz_sessions_live and the quiz session cache gauges, read when the metrics are scraped.
+
+With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory so every worker
+writes its samples there and /metrics aggregates them (gunicorn.conf.py clears it at startup).
+Ingestion jobs run in other processes too (JOB_QUEUE_BACKEND=process or celery): without
+PROMETHEUS_MULTIPROC_DIR the chatbot calls of file processing are never reported.
+
+/metrics is only served to METRICS_TOKEN as a bearer token, or without one to private network addresses.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, REGISTRY
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from models.db import query_timer
+
+# chatbot calls take seconds, the default buckets stop at 10 seconds
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latency of the HTTP requests, until the response headers",
+    ["route", "method", "status"]
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "Latency of the chatbot requests sent to the API",
+    ["prompt_type"], buckets=LLM_BUCKETS
+)
+LLM_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time until the first token of the streamed chatbot responses",
+    ["prompt_type"], buckets=LLM_BUCKETS
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens of the chatbot requests", ["prompt_type", "kind"])
+LLM_ERRORS = Counter("llm_errors_total", "Failed chatbot requests", ["prompt_type", "error"])
+LLM_CACHE_HITS = Counter("llm_cache_hits_total", "Chatbot requests served from the response cache", ["prompt_type"])
+MONGO_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "Latency of the Mongo commands",
+    ["collection", "command"], buckets=MONGO_BUCKETS
+)
+MONGO_ERRORS = Counter("mongo_command_errors_total", "Failed Mongo commands", ["collection", "command"])
+
+
+def observe_request(route, method, status, seconds):
+    REQUEST_LATENCY.labels(route, method, str(status)).observe(seconds)
+
+
+def observe_llm_usage(prompt_type, usage):
+    """Count the tokens of an OpenAI usage object, if the response has one"""
+    if usage is None:
+        return
+    observe_llm_tokens(prompt_type, usage.prompt_tokens, usage.completion_tokens)
+
+
+def observe_llm_tokens(prompt_type, prompt_tokens, completion_tokens):
+    LLM_TOKENS.labels(prompt_type, "prompt").inc(prompt_tokens or 0)
+    LLM_TOKENS.labels(prompt_type, "completion").inc(completion_tokens or 0)
+
+
+def observe_llm_cache_hit(prompt_type):
+    LLM_CACHE_HITS.labels(prompt_type).inc()
+
+
+@contextmanager
+def time_llm_request(prompt_type):
+    """Time a chatbot request sent to the API, a raised exception is counted as an error"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        LLM_ERRORS.labels(prompt_type, type(e).__name__).inc()
+        raise
+    finally:
+        LLM_LATENCY.labels(prompt_type).observe(time.perf_counter() - start)
+
+
+def observe_llm_first_token(prompt_type, seconds):
+    LLM_FIRST_TOKEN.labels(prompt_type).observe(seconds)
+
+
+def observe_mongo_command(collection, command, seconds, failed):
+    MONGO_LATENCY.labels(collection, command).observe(seconds)
+    if failed:
+        MONGO_ERRORS.labels(collection, command).inc()
+
+
+query_timer.add_observer(observe_mongo_command)
+
+
+class SessionCollector:
+    """Gauges of the live quiz sessions, read at scrape time"""
+
+    def describe(self):
+        # without describe the registry calls collect at registration, while the services are still imported
+        return []
+
+    def collect(self):
+        from config import Config
+        from models.quiz_session import QuizSession
+        from services.session_store import get_session_stats
+
+        live = GaugeMetricFamily("quiz_sessions_live", "Quizzes in progress", labels=["store"])
+        try:
+            if Config.QUIZ_SESSION_BACKEND == "memory":
+                stats = get_session_stats()
+                live.add_metric(["memory"], stats["live_sessions"])
+                yield GaugeMetricFamily(
+                    "quiz_session_cache_bytes", "Serialized size of the quizzes in the session cache", value=stats["bytes"]
+                )
+                evictions = CounterMetricFamily(
+                    "quiz_session_cache_evictions", "Quizzes evicted from the session cache", labels=["reason"]
+                )
+                for reason in ("lru", "bytes", "idle"):
+                    evictions.add_metric([reason], stats[f"evictions_{reason}"])
+                yield evictions
+            elif Config.QUIZ_SESSION_BACKEND == "mongo":
+                live.add_metric(["mongo"], QuizSession.count_live())
+        except Exception as e:
+            print(f"Error collecting session metrics: {str(e)}")
+        yield live
+
+
+REGISTRY.register(SessionCollector())
+
+
+def render_metrics():
+    """Return (body, content type) of the metrics in the Prometheus text format"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # samples of every worker, plus the gauges read by this one
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(SessionCollector())
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,31 +1,133 @@
 from services.chat.create_questions import list_initial_question, split_question_from_answer
+from services.process_and_chunk_pdf.section_questions import generate_section_chunks
 from llama_index.core import VectorStoreIndex, Settings, QueryBundle
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.readers.file import PDFReader
 from llama_index.core.postprocessor.rankGPT_rerank import RankGPTRerank
 from llama_index.llms.openai import OpenAI
+from llama_index.embeddings.openai import OpenAIEmbedding
+from services.llm_clients import get_rate_limited_http_client
+from services.embedding_cache import with_embedding_cache
+from services.singleflight import SingleFlight
+from services.metrics import time_llm_request
+from services.tracing import span, bind_context
+from models.question_bank import QuestionBank
+from config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import copy
+import hashlib
 import io
 import tempfile
 import os
 
 # TODO: make the RAG settings configurable
-Settings.llm = OpenAI(model="gpt-4o-mini")
+# reranking and embedding calls are admitted by the shared rate limiter in the transport of the HTTP client,
+# which also retries them, so the llama_index wrappers must not retry on their own
+Settings.llm = OpenAI(
+    model="gpt-4o-mini",
+    api_key=Config.OPENAI_API_KEY,
+    api_base=Config.OPENAI_BASE_URL,
+    max_retries=0,
+    http_client=get_rate_limited_http_client("rerank"),
+)
+# chunks embedded before (e.g. the same slides uploaded by another student) are not sent again,
+# only the whole_document mode indexes the documents: the default map_reduce mode embeds nothing
+Settings.embed_model = with_embedding_cache(OpenAIEmbedding(
+    api_key=Config.OPENAI_API_KEY,
+    api_base=Config.OPENAI_BASE_URL,
+    max_retries=0,
+    http_client=get_rate_limited_http_client("embedding"),
+))
 Settings.chunk_size = 128
 Settings.chunk_overlap = 32
 
-def divide_dataset_in_sections(file_data: bytes, question_count: int = 3) -> list:
+# uploads of the same file processed at the same time share a single run of the pipeline
+pdf_flights = SingleFlight()
+
+def generation_settings(question_count: int) -> dict:
+    """Settings that change the generated questions, part of the question bank key."""
+    settings = {"question_count": question_count, "mode": Config.QUESTION_GENERATION_MODE}
+    if Config.QUESTION_GENERATION_MODE == "map_reduce":
+        settings["section_max_chars"] = Config.QUESTION_SECTION_MAX_CHARS
+        settings["max_sections"] = Config.QUESTION_MAX_SECTIONS
+    return settings
+
+def divide_dataset_in_sections(file_data: bytes, question_count: int = 3, progress_callback=None, regenerate: bool = False) -> list:
+    """
+    Process a file and generate questions from its content.
+    Files processed before with the same settings get one of the question sets of the question bank,
+    unless regenerate is set, in which case a new set is generated and added to the bank.
+    Concurrent calls with the same file and question count wait for the first one instead of
+    processing the file again, only the first caller receives the progress updates.
+    """
+    file_hash = hashlib.sha256(file_data).hexdigest()
+    settings = generation_settings(question_count)
+
+    if Config.QUESTION_BANK_ENABLED and not regenerate:
+        with span("question_bank_lookup") as lookup_span:
+            chunks = QuestionBank.get_random_set(file_hash, settings)
+            if lookup_span is not None:
+                lookup_span.set_attribute("hit", bool(chunks))
+        if chunks:
+            print("Question set served from the question bank")
+            return chunks
+
+    def generate_and_store():
+        chunks = generate_chunks(file_data, question_count, progress_callback)
+        if Config.QUESTION_BANK_ENABLED and chunks:
+            QuestionBank.add_set(file_hash, settings, chunks, Config.QUESTION_BANK_MAX_SETS)
+        return chunks
+
+    key = f"{file_hash}:{question_count}"
+    chunks = pdf_flights.do(key, generate_and_store)
+    # every caller gets its own copy of the shared result
+    return copy.deepcopy(chunks)
+
+def retrieve_context(retriever, reranker, question: str):
+    """
+    Retrieve the passages matching a question and return the best one after reranking.
+    Falls back to the best retrieved passage if the reranking fails. Returns None if the retrieval
+    fails or finds nothing: answers can't be graded without a reference text, the question is dropped.
+    """
+    query = QueryBundle(question)
+    try:
+        with span("retrieve"):
+            nodes = retriever.retrieve(query)
+    except Exception as e:
+        print(f"Error retrieving context for question '{question}': {str(e)}")
+        return None
+    if not nodes:
+        return None
+
+    try:
+        # RankGPT calls the chatbot through llama_index, not query_chatbot
+        with span("rerank", nodes=len(nodes)), time_llm_request("rerank"):
+            reranked_nodes = reranker.postprocess_nodes(nodes, query)
+    except Exception as e:
+        print(f"Error reranking context for question '{question}': {str(e)}")
+        reranked_nodes = nodes
+    return (reranked_nodes or nodes)[0].text or None
+
+def generate_chunks(file_data: bytes, question_count: int = 3, progress_callback=None) -> list:
     """
     Process a file and generate questions from its content
     
     Args:
         file_data (bytes): The binary content of the file
         question_count (int): Number of questions to generate
+        progress_callback (callable): Optional, called with the current stage, the progress (0 to 1)
+            and the number of questions dropped because no reference text was found for them
         
     Returns:
         list: List of chunks with questions and answers
     """
+    def report_progress(stage, progress, failed_questions=0):
+        if progress_callback is not None:
+            progress_callback(stage, progress, failed_questions)
+
     try:
         print("Starting to process PDF...")
+        report_progress("reading", 0.0)
         
         # Create a temporary file to store the PDF data
         with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
@@ -34,11 +136,25 @@ def divide_dataset_in_sections(file_data: bytes, question_count: int = 3) -> lis
         
         try:
             # Use the temporary file path with the reader
-            reader = PDFReader()
-            documents = reader.load_data(temp_file_path)
+            with span("read_pdf", bytes=len(file_data)) as read_span:
+                reader = PDFReader()
+                documents = reader.load_data(temp_file_path)
+                if read_span is not None:
+                    read_span.set_attribute("pages", len(documents))
+            # the name of the temporary file is random, it must not end up in the embedded or prompted text
+            for document in documents:
+                document.metadata.pop("file_name", None)
+
+            if Config.QUESTION_GENERATION_MODE == "map_reduce":
+                return generate_section_chunks(documents, question_count, report_progress)
+
+            report_progress("indexing", 0.1)
             
             # Create index from documents
-            index = VectorStoreIndex.from_documents(documents)
+            with span("indexing", pages=len(documents)):
+                index = VectorStoreIndex.from_documents(documents)
+            if hasattr(Settings.embed_model, "stats"):
+                print(f"Embedding cache: {Settings.embed_model.stats()}")
             
             # Initialize retriever with similarity top_k
             retriever = VectorIndexRetriever(
@@ -52,14 +168,38 @@ def divide_dataset_in_sections(file_data: bytes, question_count: int = 3) -> lis
             )
 
             # Generate initial questions
-            questions = list_initial_question(documents, question_count)
+            report_progress("generating_questions", 0.4)
+            with span("generate_questions", question_count=question_count):
+                questions = list_initial_question(documents, question_count)
             
+            report_progress("retrieving", 0.6)
+            # The retrieval and reranking (an LLM call) of each question run concurrently,
+            # contexts are stored by position so the chunks keep the order of the questions
+            contexts = [None] * len(questions)
+            if questions:
+                workers = min(Config.RETRIEVAL_WORKERS, len(questions))
+                with span("retrieve_contexts", questions=len(questions)), \
+                        ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieval") as executor:
+                    # bound to the current span, so the spans of every question nest under it
+                    futures = {
+                        executor.submit(bind_context(retrieve_context), retriever, reranker, question): position
+                        for position, question in enumerate(questions)
+                    }
+                    for completed, future in enumerate(as_completed(futures), start=1):
+                        contexts[futures[future]] = future.result()
+                        report_progress("retrieving", 0.6 + 0.4 * completed / len(questions))
+
+            failed = contexts.count(None)
+            if failed:
+                print(f"No reference text found for {failed} of {len(questions)} questions")
+                if failed == len(questions):
+                    raise RuntimeError("Context retrieval failed for every question")
+                report_progress("retrieving", 1.0, failed_questions=failed)
+
             chunks = []
-            for question in questions:
-                query = QueryBundle(question)
-                nodes = retriever.retrieve(query)
-                reranked_nodes = reranker.postprocess_nodes(nodes, query)
-                context = reranked_nodes[0].text if reranked_nodes else ""
+            for question, context in zip(questions, contexts):
+                if context is None:
+                    continue
                 question, answer = split_question_from_answer(question)
                 
                 # Format the chunk to match ChatManager's expected structure
@@ -77,7 +217,7 @@ def divide_dataset_in_sections(file_data: bytes, question_count: int = 3) -> lis
                 os.remove(temp_file_path)
                 
     except Exception as e:
-        print(f"Error in divide_dataset_in_sections: {str(e)}")
+        print(f"Error in generate_chunks: {str(e)}")
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
         raise
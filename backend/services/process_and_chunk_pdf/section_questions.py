@@ -0,0 +1,108 @@
+import math
+import re
+
+from config import Config
+from services.chat.create_questions import list_section_questions, split_question_from_answer
+from services.tracing import span
+
+
+def split_into_sections(documents: list, max_chars: int) -> list:
+    """
+    Groups consecutive pages into sections of at most max_chars characters.
+    Pages longer than max_chars are cut at the last whitespace before the limit.
+    """
+    sections = []
+    current = ""
+    for document in documents:
+        text = document.text.strip()
+        while len(text) > max_chars:
+            cut = text.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                sections.append(current)
+                current = ""
+            sections.append(text[:cut].strip())
+            text = text[cut:].strip()
+        if not text:
+            continue
+        if current and len(current) + len(text) + 2 > max_chars:
+            sections.append(current)
+            current = ""
+        current = f"{current}\n\n{text}" if current else text
+    if current:
+        sections.append(current)
+    return sections
+
+
+def pick_evenly(items: list, count: int) -> list:
+    """Picks count items spread evenly over the list, keeping their order."""
+    if count >= len(items):
+        return list(items)
+    return [items[math.floor(i * len(items) / count)] for i in range(count)]
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"[^a-z0-9 ]", "", question.lower()).strip()
+
+
+def select_diverse_questions(section_questions: list, question_count: int) -> list:
+    """
+    Reduce step: picks question_count questions from the candidates of every section.
+    Sections are taken round-robin so the questions cover the whole document, duplicated questions
+    are skipped. Returns (section index, question) pairs in document order.
+    """
+    selected = []
+    seen = set()
+    rounds = max((len(questions) for questions in section_questions), default=0)
+    for round_index in range(rounds):
+        candidates = []
+        for section_index, questions in enumerate(section_questions):
+            if round_index >= len(questions):
+                continue
+            key = normalize_question(questions[round_index].split("|")[0])
+            if key in seen:
+                continue
+            seen.add(key)
+            candidates.append((section_index, round_index, questions[round_index]))
+
+        selected.extend(pick_evenly(candidates, question_count - len(selected)))
+        if len(selected) >= question_count:
+            break
+
+    selected.sort()
+    return [(section_index, question) for section_index, _, question in selected]
+
+
+def generate_section_chunks(documents: list, question_count: int, report_progress) -> list:
+    """
+    Map-reduce question generation: candidate questions are generated for every section concurrently,
+    then question_count of them are selected. The section a question comes from is its reference text,
+    so no retrieval is needed.
+    """
+    sections = split_into_sections(documents, Config.QUESTION_SECTION_MAX_CHARS)
+    # very long documents only get questions from evenly spread sections
+    sections = pick_evenly(sections, Config.QUESTION_MAX_SECTIONS)
+    if not sections:
+        return []
+
+    report_progress("generating_questions", 0.1)
+    # one spare candidate per section leaves the reduce step some choice
+    per_section = math.ceil(question_count / len(sections)) + 1
+    with span("generate_questions", sections=len(sections), per_section=per_section):
+        section_questions = list_section_questions(sections, per_section)
+    # only keep well formed "question | answer" lines
+    section_questions = [
+        [question for question in questions if question.count("|") == 1]
+        for questions in section_questions
+    ]
+
+    chunks = []
+    for section_index, question in select_diverse_questions(section_questions, question_count):
+        question, answer = split_question_from_answer(question)
+        chunks.append({
+            "text": sections[section_index],
+            "question": question.strip(),
+            "answer": answer.strip(),
+            "type": "basic"
+        })
+    return chunks
@@ -1,7 +1,15 @@
-from openai import OpenAI
-from config import Config  # Import the configuration
+import asyncio
+import time
+from contextlib import closing
+from services.llm_cache import get_response_cache, make_cache_key
+from services.llm_clients import get_sync_client, get_async_client, run_coroutine
+from services.llm_rate_limiter import call_with_rate_limit, call_with_rate_limit_async, stream_with_rate_limit
+from services.singleflight import SingleFlight
+from services.metrics import time_llm_request, observe_llm_usage, observe_llm_cache_hit, observe_llm_first_token
+from services.tracing import span, record_span, current_span, activate
 
-client = OpenAI(api_key=Config.OPENAI_API_KEY)
+# identical chatbot requests in flight at the same time are only sent once
+chatbot_flights = SingleFlight()
 
 def create_chat_messages(system_prompt, user_prompt):
     """Create the chat messages for the chatbot request."""
@@ -11,21 +19,190 @@ def create_chat_messages(system_prompt, user_prompt):
         {"role": "user", "content": user_prompt}
     ]
 
-def get_chat_response(client, model, messages):
+def get_chat_response(client, model, messages, **params):
     """Create a response from the chatbot based on the given parameters."""
 
     return client.chat.completions.create(
+        model=model,
+        messages=messages,
+        **params
+    )
+
+def get_chat_response_stream(client, model, messages):
+    """Create a streamed response from the chatbot, chunks are returned as they are generated."""
+
+    return client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True}  # the last chunk has the token usage
+    )
+
+async def get_chat_response_async(client, model, messages):
+    """Create a response from the chatbot without blocking the event loop."""
+
+    return await client.chat.completions.create(
         model=model,
         messages=messages
     )
 
-def query_chatbot(system_prompt, user_prompt):
-    """Query the chatbot with the given prompt and optional response format."""
+def record_usage(llm_span, usage):
+    """Add the token counts of an OpenAI usage object to the span of the request"""
+    if llm_span is not None and usage is not None:
+        llm_span.set_attribute("prompt_tokens", usage.prompt_tokens)
+        llm_span.set_attribute("completion_tokens", usage.completion_tokens)
+
+def query_chatbot(system_prompt, user_prompt, use_cache=True, response_format=None, prompt_type="other"):
+    """
+    Query the chatbot with the given prompt and optional response format.
+    Identical requests are served from the response cache, or share the response of an identical request
+    already in flight, unless use_cache is False. prompt_type labels the metrics of the call.
+    """
+    model = "gpt-4o-mini"
+
+    messages = create_chat_messages(system_prompt, user_prompt)
+    params = {"response_format": response_format} if response_format else {}
+
+    def request_content():
+        with span("llm request", prompt_type=prompt_type) as llm_span, time_llm_request(prompt_type):
+            response = call_with_rate_limit(lambda: get_chat_response(get_sync_client(), model, messages, **params), messages)
+            record_usage(llm_span, response.usage)
+        observe_llm_usage(prompt_type, response.usage)
+        return response.choices[0].message.content
+
+    with span(f"llm {prompt_type}", prompt_type=prompt_type, cached=False) as llm_span:
+        if not use_cache:
+            return request_content()
+
+        cache_key = make_cache_key(model, messages, params)
+        cache = get_response_cache()
+        if cache is not None:
+            cached_response = cache.get(cache_key)
+            if cached_response is not None:
+                observe_llm_cache_hit(prompt_type)
+                if llm_span is not None:
+                    llm_span.set_attribute("cached", True)
+                return cached_response
+
+        def request_and_cache_content():
+            content = request_content()
+            if cache is not None and content is not None:
+                cache.set(cache_key, content)
+            return content
+
+        return chatbot_flights.do(cache_key, request_and_cache_content)
+
+def query_chatbot_stream(system_prompt, user_prompt, use_cache=True, prompt_type="other"):
+    """
+    Query the chatbot and yield the response text as it is generated.
+    A cached response is yielded in one piece, a complete streamed response is added to the cache.
+    """
+    model = "gpt-4o-mini"
+
+    messages = create_chat_messages(system_prompt, user_prompt)
+
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = make_cache_key(model, messages)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            observe_llm_cache_hit(prompt_type)
+            yield cached_response
+            return
+
+    chunks = []
+    usage = None
+    start = time.perf_counter()
+    start_ns = time.time_ns()
+    first_token_ms = None
+    error = None
+    # timed until the last chunk, including the time the caller takes to handle the tokens
+    try:
+        with time_llm_request(prompt_type):
+            # the concurrency slot is held until the last chunk, or until the caller stops reading
+            stream = stream_with_rate_limit(lambda: get_chat_response_stream(get_sync_client(), model, messages), messages)
+            with closing(stream):
+                for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not chunks:
+                            observe_llm_first_token(prompt_type, time.perf_counter() - start)
+                            first_token_ms = round((time.perf_counter() - start) * 1000, 3)
+                        chunks.append(delta)
+                        yield delta
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        # recorded once the stream is done, a span entered in a generator would also be the parent
+        # of the work of the caller between two tokens
+        record_span(
+            f"llm {prompt_type}", start_ns, time.time_ns(), error=error, prompt_type=prompt_type, stream=True,
+            first_token_ms=first_token_ms, prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None
+        )
+    observe_llm_usage(prompt_type, usage)
+
+    if cache is not None and chunks:
+        cache.set(cache_key, "".join(chunks))
+
+async def query_chatbot_async(system_prompt, user_prompt, use_cache=True, prompt_type="other"):
+    """Async variant of query_chatbot, lets callers await several chatbot queries at once."""
     model = "gpt-4o-mini"
 
     messages = create_chat_messages(system_prompt, user_prompt)
-    response = get_chat_response(client, model, messages)
-    return response.choices[0].message.content
+
+    async def request_content():
+        with span("llm request", prompt_type=prompt_type) as llm_span, time_llm_request(prompt_type):
+            response = await call_with_rate_limit_async(lambda: get_chat_response_async(get_async_client(), model, messages), messages)
+            record_usage(llm_span, response.usage)
+        observe_llm_usage(prompt_type, response.usage)
+        return response.choices[0].message.content
+
+    with span(f"llm {prompt_type}", prompt_type=prompt_type, cached=False) as llm_span:
+        if not use_cache:
+            return await request_content()
+
+        cache_key = make_cache_key(model, messages)
+        cache = get_response_cache()
+        if cache is not None:
+            # the persistent tier reads SQLite, which would block every coroutine of the shared event loop
+            cached_response = await asyncio.to_thread(cache.get, cache_key)
+            if cached_response is not None:
+                observe_llm_cache_hit(prompt_type)
+                if llm_span is not None:
+                    llm_span.set_attribute("cached", True)
+                return cached_response
+
+        async def request_and_cache_content():
+            content = await request_content()
+            if cache is not None and content is not None:
+                await asyncio.to_thread(cache.set, cache_key, content)
+            return content
+
+        return await chatbot_flights.do_async(cache_key, request_and_cache_content)
+
+def query_chatbot_many(prompts, use_cache=True, return_exceptions=False, prompt_type="other"):
+    """
+    Run several (system_prompt, user_prompt) queries concurrently from synchronous code.
+    Responses are returned in the order of the prompts. With return_exceptions, a failed query
+    returns its exception instead of failing all of them.
+    """
+    # the queries run on the background event loop, which does not see the current span of this thread
+    parent = current_span()
+
+    async def gather():
+        with activate(parent):
+            return await asyncio.gather(*(
+                query_chatbot_async(system_prompt, user_prompt, use_cache=use_cache, prompt_type=prompt_type)
+                for system_prompt, user_prompt in prompts
+            ), return_exceptions=return_exceptions)
+
+    return list(run_coroutine(gather()))
 
 
 
@@ -33,4 +210,4 @@ if __name__ == "__main__":
     system_prompt = "Hello, how are you?"
     user_prompt = "I'm doing well, thank you. How are you doing?"
     response = query_chatbot(system_prompt, user_prompt)
-    print(response)
\ No newline at end of file
+    print(response)
@@ -0,0 +1,320 @@
+"""
+Write-behind buffering of ranking awards.
+
+Awards are aggregated in memory per (course, user) and written by a background thread in a single
+bulk write, every RANKING_FLUSH_INTERVAL seconds, as soon as RANKING_FLUSH_MAX_PENDING users are
+pending, and when the process exits. Crash safety depends on RANKING_BUFFER_DURABILITY:
+
+- none: awards not flushed yet are lost if the process crashes.
+- journal: every award is appended to a journal file of the process before it is acknowledged,
+  the journals of crashed processes are replayed by the next buffer started on the host.
+  Survives a crash of the process, not of the host.
+- fsync: like journal, the journal is also synced to disk on every award. Survives a crash of the host.
+
+Replaying a journal is at-least-once: awards of a process that crashed between a bulk write and the
+removal of its journal segments are counted twice.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from pymongo.errors import BulkWriteError
+
+from config import Config
+from models.ranking import Ranking
+from services.tracing import span
+
+
+class AwardJournal:
+    """
+    Append-only journal of the awards not flushed yet, in segments "<pid>-<seq>.jsonl".
+    Each process holds an exclusive lock on "<pid>.lock" while it is alive, the segments of a
+    process whose lock can be taken belong to a crashed process.
+    """
+
+    def __init__(self, directory: str, fsync: bool):
+        self.directory = directory
+        self.fsync = fsync
+        self.pid = os.getpid()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, f"{self.pid}.lock")
+        self._lock_file = open(self._lock_path, "w")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        # segments of a previous process with the same pid are recovered, new ones must not reuse their names
+        self.sequence = max((self._sequence_of(path) for path in self._segment_paths(str(self.pid))), default=-1) + 1
+        self._segment = None
+        self._recovering = []  # (lock file, lock path, segment paths) of the crashed processes being recovered
+
+    def _segment_path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"{self.pid}-{sequence}.jsonl")
+
+    def _segment_paths(self, pid: str) -> list:
+        return glob.glob(os.path.join(self.directory, f"{pid}-*.jsonl"))
+
+    @staticmethod
+    def _sequence_of(path: str) -> int:
+        return int(os.path.basename(path).split("-")[1].split(".")[0])
+
+    def recover(self) -> list:
+        """
+        Return the awards of the crashed processes of the host. Their journals are only removed by
+        finish_recovery, once the awards are in the journal of this process.
+        """
+        awards = []
+        for lock_path in glob.glob(os.path.join(self.directory, "*.lock")):
+            pid = os.path.basename(lock_path)[:-len(".lock")]
+            if pid == str(self.pid):
+                # segments left by a previous process with the same pid
+                paths = self._segment_paths(pid)
+                awards.extend(self._read_segments(paths))
+                self._recovering.append((None, None, paths))
+                continue
+            lock_file = open(lock_path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue  # the process is alive
+            # the lock is kept until the journals are removed, so no other process recovers them too
+            paths = self._segment_paths(pid)
+            awards.extend(self._read_segments(paths))
+            self._recovering.append((lock_file, lock_path, paths))
+        return awards
+
+    def finish_recovery(self) -> None:
+        """Remove the recovered journals, after the recovered awards are synced to this journal."""
+        if not self._recovering:
+            return
+        self.sync()
+        for lock_file, lock_path, paths in self._recovering:
+            for path in paths:
+                os.remove(path)
+            if lock_file is not None:
+                os.remove(lock_path)
+                lock_file.close()
+        self._recovering = []
+
+    def _read_segments(self, paths: list) -> list:
+        awards = []
+        for path in paths:
+            with open(path) as segment:
+                for line in segment:
+                    try:
+                        awards.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass  # line cut by the crash
+        return awards
+
+    def append(self, award: dict) -> None:
+        if self._segment is None:
+            self._segment = open(self._segment_path(self.sequence), "a")
+        self._segment.write(json.dumps(award) + "\n")
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+
+    def rotate(self) -> int:
+        """Start a new segment, returns the sequence of the last segment before it."""
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        last = self.sequence
+        self.sequence += 1
+        return last
+
+    def sync(self) -> None:
+        if self._segment is not None:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+
+    def discard(self, up_to: int) -> None:
+        """Remove the segments whose awards are written to Mongo."""
+        for path in self._segment_paths(str(self.pid)):
+            if self._sequence_of(path) <= up_to:
+                os.remove(path)
+
+    def close(self) -> None:
+        """
+        Release the journal on a clean shutdown. The lock file is only removed when every award is
+        written to Mongo, otherwise the next process on the host recovers the remaining segments.
+        """
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if not self._segment_paths(str(self.pid)):
+            os.remove(self._lock_path)
+        self._lock_file.close()
+
+
+class RankingBuffer:
+    def __init__(self, flush_interval: float, max_pending: int, journal: Optional[AwardJournal] = None):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.journal = journal
+        self._pending = {}  # (course_id, user_id) -> {"points", "user_name", "awards"}
+        self._oldest_pending_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._counters = {
+            "awards": 0,
+            "flushes": 0,
+            "flushed_awards": 0,
+            "flushed_writes": 0,
+            "flush_errors": 0,
+        }
+        self._last_flush = {"at": None, "seconds": 0.0, "lag_seconds": 0.0}
+        self._awards_in_pending = 0
+
+        if journal is not None:
+            recovered = journal.recover()
+            try:
+                # journaled again and synced before the journals of the crashed processes are removed
+                for award in recovered:
+                    journal.append(award)
+                journal.finish_recovery()
+            except OSError as e:
+                # the journals are kept and recovered again by the next process, the awards may count twice
+                print(f"Error recovering ranking journals: {str(e)}")
+            for award in recovered:
+                self._add(award, journaled=True)
+            if recovered:
+                print(f"Recovered {len(recovered)} ranking awards from crashed workers")
+
+        self._thread = threading.Thread(target=self._run, name="ranking-buffer", daemon=True)
+        self._thread.start()
+
+    def _add(self, award: dict, journaled: bool = False) -> None:
+        with self._lock:
+            if self.journal is not None and not journaled:
+                try:
+                    self.journal.append(award)
+                except OSError as e:
+                    print(f"Error writing ranking journal: {str(e)}")
+            key = (award["course_id"], award["user_id"])
+            pending = self._pending.setdefault(key, {"points": 0, "user_name": award["user_name"], "awards": 0})
+            pending["points"] += award["points"]
+            pending["awards"] += 1
+            pending["user_name"] = award["user_name"]
+            if self._oldest_pending_at is None:
+                self._oldest_pending_at = time.time()
+            self._awards_in_pending += 1
+            self._counters["awards"] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def add(self, course_id, user_id, user_name, points) -> None:
+        self._add({"course_id": course_id, "user_id": user_id, "user_name": user_name, "points": points})
+
+    def flush(self) -> None:
+        """Write the pending awards in one bulk write, they are kept for the next flush if it fails."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+                awards, self._awards_in_pending = self._awards_in_pending, 0
+                oldest_pending_at, self._oldest_pending_at = self._oldest_pending_at, None
+                segment = self.journal.rotate() if self.journal is not None else None
+
+            start = time.time()
+            try:
+                writes = Ranking.add_points_many(pending)
+            except Exception as e:
+                print(f"Error flushing rankings: {str(e)}")
+                if isinstance(e, BulkWriteError):
+                    # only the failed upserts are retried, the others are applied
+                    keys = list(pending)
+                    pending = {keys[error["index"]]: pending[keys[error["index"]]] for error in e.details["writeErrors"]}
+                with self._lock:
+                    self._counters["flush_errors"] += 1
+                    self._counters["flushed_awards"] += awards - sum(increment["awards"] for increment in pending.values())
+                    # merged back, the journal segments are kept until a flush succeeds
+                    for key, increment in pending.items():
+                        current = self._pending.setdefault(
+                            key, {"points": 0, "user_name": increment["user_name"], "awards": 0}
+                        )
+                        current["points"] += increment["points"]
+                        current["awards"] += increment["awards"]
+                        self._awards_in_pending += increment["awards"]
+                    if self._oldest_pending_at is None or oldest_pending_at < self._oldest_pending_at:
+                        self._oldest_pending_at = oldest_pending_at
+                return
+
+            if self.journal is not None:
+                self.journal.discard(segment)
+            now = time.time()
+            with self._lock:
+                self._counters["flushes"] += 1
+                self._counters["flushed_awards"] += awards
+                self._counters["flushed_writes"] += writes
+                self._last_flush = {"at": now, "seconds": now - start, "lag_seconds": now - oldest_pending_at}
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self) -> None:
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+        if self.journal is not None:
+            with self._flush_lock:
+                self.journal.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending_users"] = len(self._pending)
+            stats["pending_awards"] = self._awards_in_pending
+            # how far the rankings in Mongo are behind the awards
+            stats["lag_seconds"] = time.time() - self._oldest_pending_at if self._oldest_pending_at else 0.0
+            stats["last_flush_lag_seconds"] = self._last_flush["lag_seconds"]
+            stats["last_flush_seconds"] = self._last_flush["seconds"]
+            stats["last_flush_at"] = self._last_flush["at"]
+        stats["awards_per_write"] = stats["flushed_awards"] / stats["flushed_writes"] if stats["flushed_writes"] else 0.0
+        return stats
+
+
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+def get_ranking_buffer() -> Optional[RankingBuffer]:
+    """Return the buffer of the current process, or None if write-behind is disabled."""
+    global _buffer, _buffer_pid
+    if not Config.RANKING_WRITE_BEHIND:
+        return None
+    with _buffer_lock:
+        # the flush thread does not survive a fork, every worker starts its own buffer
+        if _buffer is None or _buffer_pid != os.getpid():
+            journal = None
+            if Config.RANKING_BUFFER_DURABILITY in ("journal", "fsync"):
+                journal = AwardJournal(Config.RANKING_JOURNAL_DIR, fsync=Config.RANKING_BUFFER_DURABILITY == "fsync")
+            _buffer = RankingBuffer(Config.RANKING_FLUSH_INTERVAL, Config.RANKING_FLUSH_MAX_PENDING, journal)
+            _buffer_pid = os.getpid()
+            atexit.register(_buffer.close)
+    return _buffer
+
+
+def award_points(course_id, user_id, user_name, points) -> bool:
+    """Add points to a ranking, through the write-behind buffer when it is enabled."""
+    if not course_id or not user_id:
+        print(f"Not awarding points without a course and user: {course_id}, {user_id}")
+        return False
+    buffer = get_ranking_buffer()
+    with span("award_points", buffered=buffer is not None):
+        if buffer is None:
+            return Ranking.add_points(course_id, user_id, user_name, points)
+        buffer.add(course_id, user_id, user_name, points)
+        return True
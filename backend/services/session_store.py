@@ -0,0 +1,251 @@
+"""
+Shared store of the quizzes in progress, so that any worker or node can serve the next request of a
+quiz. A quiz is stored as its Chat.to_dict state under the quiz session id, with a TTL refreshed on
+every save, so abandoned quizzes expire.
+
+QUIZ_SESSION_BACKEND selects the store: mongo (default), redis, or memory (a single process only,
+bounded, spilling to QUIZ_SESSION_SPILL_BACKEND).
+"""
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import Config
+from models.quiz_session import QuizSession
+from services.chat.chat import Chat
+from services.tracing import span
+
+
+class MemorySessionStore:
+    """
+    Bounded in-process cache of the quizzes, for a single process. The least recently used quizzes
+    are evicted beyond max_entries or max_bytes (size of their serialized state), and quizzes idle
+    for idle_seconds are evicted. Evicted quizzes are spilled to spill_store if there is one, and
+    restored from it by the next request of the quiz. Without one, they are lost.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, idle_seconds: int, spill_store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_store = spill_store
+        self._entries = OrderedDict()  # session id -> (last used, serialized state), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "spill_hits": 0,
+            "evictions_lru": 0,
+            "evictions_bytes": 0,
+            "evictions_idle": 0,
+            "spills": 0,
+            "spill_errors": 0,
+        }
+
+    def _remove(self, session_id: str) -> str:
+        _, serialized = self._entries.pop(session_id)
+        self._bytes -= len(serialized)
+        return serialized
+
+    def _put(self, session_id: str, serialized: str) -> list:
+        """Store the state, returns the evicted (session id, state) pairs to spill."""
+        now = time.time()
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+            self._entries[session_id] = (now, serialized)
+            self._bytes += len(serialized)
+
+            evicted = []
+            # entries are ordered by last use, the idle ones are at the front
+            while self._entries:
+                oldest_id, (last_used, _) = next(iter(self._entries.items()))
+                if now - last_used > self.idle_seconds:
+                    reason = "evictions_idle"
+                elif len(self._entries) > self.max_entries:
+                    reason = "evictions_lru"
+                elif self._bytes > self.max_bytes and oldest_id != session_id:
+                    reason = "evictions_bytes"
+                else:
+                    break
+                evicted.append((oldest_id, self._remove(oldest_id)))
+                self._counters[reason] += 1
+        return evicted
+
+    def _spill(self, evicted: list) -> None:
+        if self.spill_store is None:
+            return
+        for session_id, serialized in evicted:
+            try:
+                self.spill_store.set(session_id, json.loads(serialized))
+                with self._lock:
+                    self._counters["spills"] += 1
+            except Exception as e:
+                print(f"Error spilling quiz session {session_id}: {str(e)}")
+                with self._lock:
+                    self._counters["spill_errors"] += 1
+
+    def get(self, session_id: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and now - entry[0] > self.idle_seconds:
+                evicted = [(session_id, self._remove(session_id))]
+                self._counters["evictions_idle"] += 1
+                entry = None
+            else:
+                evicted = []
+            if entry is not None:
+                self._entries[session_id] = (now, entry[1])
+                self._entries.move_to_end(session_id)
+                self._counters["hits"] += 1
+            else:
+                self._counters["misses"] += 1
+        self._spill(evicted)
+
+        if entry is not None:
+            # stored serialized: the size is known, and a restored Chat never shares objects with the store
+            return json.loads(entry[1])
+        if self.spill_store is None:
+            return None
+
+        state = self.spill_store.get(session_id)
+        if state is not None:
+            with self._lock:
+                self._counters["spill_hits"] += 1
+            self._spill(self._put(session_id, json.dumps(state, separators=(",", ":"))))
+        return state
+
+    def set(self, session_id: str, state: dict) -> None:
+        self._spill(self._put(session_id, json.dumps(state, separators=(",", ":"))))
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+        if self.spill_store is not None:
+            self.spill_store.delete(session_id)
+
+    def close(self) -> None:
+        """Spill every cached quiz, so they survive a restart of the process."""
+        with self._lock:
+            evicted = [(session_id, serialized) for session_id, (_, serialized) in self._entries.items()]
+            self._entries.clear()
+            self._bytes = 0
+        self._spill(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["live_sessions"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        stats["evictions"] = stats["evictions_lru"] + stats["evictions_bytes"] + stats["evictions_idle"]
+        return stats
+
+
+class MongoSessionStore:
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, session_id: str) -> Optional[dict]:
+        return QuizSession.get(session_id)
+
+    def set(self, session_id: str, state: dict) -> None:
+        QuizSession.save(session_id, state, self.ttl_seconds)
+
+    def delete(self, session_id: str) -> None:
+        QuizSession.delete(session_id)
+
+
+class RedisSessionStore:
+    def __init__(self, url: str, ttl_seconds: int, prefix: str = "quiz_session:"):
+        import redis
+
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, session_id: str) -> Optional[dict]:
+        serialized = self._redis.get(self.prefix + session_id)
+        return json.loads(serialized) if serialized is not None else None
+
+    def set(self, session_id: str, state: dict) -> None:
+        self._redis.set(self.prefix + session_id, json.dumps(state, separators=(",", ":")), ex=self.ttl_seconds)
+
+    def delete(self, session_id: str) -> None:
+        self._redis.delete(self.prefix + session_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def build_shared_store(backend: str):
+    if backend == "redis":
+        return RedisSessionStore(Config.QUIZ_SESSION_REDIS_URL, Config.QUIZ_SESSION_TTL)
+    if backend == "mongo":
+        return MongoSessionStore(Config.QUIZ_SESSION_TTL)
+    raise ValueError(f"Unknown quiz session backend: {backend}")
+
+
+def build_session_store():
+    if Config.QUIZ_SESSION_BACKEND == "memory":
+        store = MemorySessionStore(
+            Config.QUIZ_SESSION_CACHE_MAX_ENTRIES,
+            Config.QUIZ_SESSION_CACHE_MAX_BYTES,
+            Config.QUIZ_SESSION_CACHE_IDLE_SECONDS,
+            # none: evicted quizzes are lost
+            spill_store=(
+                build_shared_store(Config.QUIZ_SESSION_SPILL_BACKEND) if Config.QUIZ_SESSION_SPILL_BACKEND != "none" else None
+            ),
+        )
+        atexit.register(store.close)
+        return store
+    return build_shared_store(Config.QUIZ_SESSION_BACKEND)
+
+
+def get_session_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = build_session_store()
+    return _store
+
+
+def get_session_stats() -> dict:
+    """Gauges of the in-process quiz cache, empty for the shared stores"""
+    store = get_session_store()
+    return store.stats() if hasattr(store, "stats") else {}
+
+
+def load_chat(session_id: str) -> Optional[Chat]:
+    """
+    Restore the quiz of the session, None if there is none or its state can't be restored.
+    Errors of the store are raised: the request fails and the saved quiz is kept.
+    """
+    with span("load_quiz_session", backend=Config.QUIZ_SESSION_BACKEND):
+        state = get_session_store().get(session_id)
+    if state is None:
+        return None
+    try:
+        return Chat.from_dict(state)
+    except (ValueError, KeyError) as e:
+        print(f"Error restoring quiz session {session_id}: {str(e)}")
+        return None
+
+
+def save_chat(session_id: str, chat: Chat) -> None:
+    with span("save_quiz_session", backend=Config.QUIZ_SESSION_BACKEND):
+        get_session_store().set(session_id, chat.to_dict())
+
+
+def delete_chat(session_id: str) -> None:
+    try:
+        get_session_store().delete(session_id)
+    except Exception as e:
+        print(f"Error deleting quiz session {session_id}: {str(e)}")
@@ -0,0 +1,396 @@
+"""
+Lightweight request tracing: every request gets a trace id and its work is recorded as nested spans
+(chatbot calls, file processing stages, Mongo commands).
+
+    with span("evaluate", question_count=3):
+        ...
+
+The spans of a trace are kept in memory until its root span ends. The trace is exported if it was
+sampled (TRACE_SAMPLE_RATE) or if it took longer than its slow threshold (TRACE_SLOW_MS, or the one of
+its name in TRACE_SLOW_MS_BY_NAME), so slow requests are always captured. Traces are exported from a
+background thread, as one JSON line per trace to TRACE_FILE, rotated beyond TRACE_FILE_MAX_BYTES
+(TRACE_EXPORTER=jsonl), or to an OTLP/HTTP collector at TRACE_OTLP_ENDPOINT (TRACE_EXPORTER=otlp).
+With TRACE_EXPORTER=none nothing is recorded.
+
+The current span is a context variable: code running in other threads (thread pools, the background
+event loop) must be given the span with bind_context or activate, or its spans start a new trace.
+"""
+import contextvars
+import fcntl
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from config import Config
+from models.db import query_timer
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+_exporter = None
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+_slow_thresholds = None
+
+
+class Trace:
+    """Spans of one request or job, exported together when the root span ends"""
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.dropped_spans = 0
+
+    def add(self, span):
+        # a job can run thousands of Mongo commands, only the first spans are kept
+        if len(self.spans) < Config.TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+
+class Span:
+    def __init__(self, trace, name, parent=None, attributes=None, start_ns=None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = None
+        self.error = None
+        trace.add(self)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_ns=None):
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    @property
+    def duration_ms(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def tracing_enabled():
+    return Config.TRACE_EXPORTER != "none"
+
+
+def slow_threshold_ms(name):
+    """Slow threshold of the traces with this root span name"""
+    global _slow_thresholds
+    if _slow_thresholds is None:
+        thresholds = {}
+        for entry in Config.TRACE_SLOW_MS_BY_NAME.split(","):
+            trace_name, _, threshold = entry.rpartition("=")
+            if trace_name.strip():
+                thresholds[trace_name.strip()] = float(threshold)
+        _slow_thresholds = thresholds
+    return _slow_thresholds.get(name, Config.TRACE_SLOW_MS)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_trace_id():
+    current = _current_span.get()
+    return current.trace.trace_id if current is not None else None
+
+
+def parse_traceparent(header):
+    """Trace id and parent span id of a W3C traceparent header, or (None, None)"""
+    parts = (header or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    return parts[1], parts[2]
+
+
+def start_trace(name, trace_id=None, parent_id=None, **attributes):
+    """
+    Start the root span of a new trace and make it the current span, returns (span, token).
+    Must be followed by end_trace(span, token), use trace() when the work fits in a with block.
+    """
+    if not tracing_enabled():
+        return None, None
+    root = Span(
+        Trace(trace_id or secrets.token_hex(16), random.random() < Config.TRACE_SAMPLE_RATE), name, attributes=attributes
+    )
+    # the parent span of a traceparent header lives in the caller's process
+    root.parent_id = parent_id
+    return root, _current_span.set(root)
+
+
+def end_trace(root, token=None, error=None):
+    """End the root span and export the trace if it was sampled or slow"""
+    if root is None:
+        return
+    if token is not None:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # ended from another context (a streamed response), the context is discarded anyway
+            pass
+    if error is not None:
+        root.error = error
+    root.end()
+
+    slow = root.duration_ms >= slow_threshold_ms(root.name)
+    if slow:
+        print(f"Slow trace: {root.name} took {root.duration_ms:.0f} ms, trace {root.trace.trace_id}")
+    if slow or root.trace.sampled:
+        get_exporter().submit(root, slow)
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Record the work of the block as a new trace, e.g. a background job"""
+    root, token = start_trace(name, **attributes)
+    error = None
+    try:
+        yield root
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        end_trace(root, token, error)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record the block as a child of the current span, does nothing outside of a trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def record_span(name, start_ns, end_ns, error=None, **attributes):
+    """Add an already finished span under the current span, for work timed by someone else"""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, name, parent, attributes, start_ns=start_ns)
+    child.error = error
+    child.end(end_ns)
+
+
+@contextmanager
+def activate(parent):
+    """Make parent the current span in this context, for work handed over to another thread"""
+    token = _current_span.set(parent)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def bind_context(fn):
+    """Wrap fn to run in a copy of the current context, e.g. before submitting it to a thread pool"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def record_mongo_span(collection, command_name, seconds, failed):
+    # command listeners run in the thread sending the command, once it has finished
+    end_ns = time.time_ns()
+    record_span(
+        f"mongo {command_name}", end_ns - int(seconds * 1e9), end_ns,
+        error="command failed" if failed else None, collection=collection
+    )
+
+
+query_timer.add_observer(record_mongo_span)
+
+
+class TraceExporter(ABC):
+    """Exports finished traces from a background thread, traces are dropped when the queue is full"""
+
+    def __init__(self, max_queue_size):
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._counters = {"exported": 0, "dropped": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, root, slow):
+        try:
+            self._queue.put_nowait((root, slow))
+        except queue.Full:
+            self._counters["dropped"] += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # a burst of slow requests is written in one go
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+                self._counters["exported"] += len(batch)
+            except Exception as e:
+                self._counters["errors"] += 1
+                print(f"Error exporting traces: {str(e)}")
+
+    @abstractmethod
+    def export(self, batch):
+        """Export a batch of (root span, slow) pairs, called from the exporter thread"""
+
+    def stats(self) -> dict:
+        return dict(self._counters, queued=self._queue.qsize())
+
+
+class JsonLinesExporter(TraceExporter):
+    """
+    One JSON object per trace, appended to a file shared by the workers. The file is rotated when it
+    would grow beyond max_bytes, the last backups files are kept as path.1 (the newest) to path.<backups>.
+    """
+
+    def __init__(self, path, max_queue_size, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        super().__init__(max_queue_size)
+
+    def export(self, batch):
+        lines = []
+        for root, slow in batch:
+            lines.append(json.dumps({
+                "trace_id": root.trace.trace_id,
+                "name": root.name,
+                "start": root.start_ns / 1e9,
+                "duration_ms": round(root.duration_ms, 3),
+                "slow": slow,
+                "sampled": root.trace.sampled,
+                "dropped_spans": root.trace.dropped_spans,
+                "pid": os.getpid(),
+                "spans": [span.to_dict() for span in root.trace.spans],
+            }, default=str) + "\n")
+        data = "".join(lines)
+        # the workers rotate and append under a lock file, a single append per batch
+        with open(self.path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self.rotate()
+            with open(self.path, "a") as output:
+                output.write(data)
+
+    def rotate(self):
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class OtlpExporter(TraceExporter):
+    """Sends the traces to an OpenTelemetry collector, with the JSON encoding of OTLP/HTTP"""
+
+    def __init__(self, endpoint, service_name, max_queue_size):
+        import requests
+
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._session = requests.Session()
+        super().__init__(max_queue_size)
+
+    def to_otlp(self, span, root, slow):
+        otlp_span = {
+            "traceId": span.trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 2 if span is root else 1,  # server for the root span, internal for the others
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": _otlp_attributes(span.attributes),
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        if span.error:
+            otlp_span["status"] = {"code": 2, "message": span.error}
+        if span is root:
+            otlp_span["attributes"] += _otlp_attributes({"trace.slow": slow, "trace.sampled": root.trace.sampled})
+        return otlp_span
+
+    def export(self, batch):
+        spans = [self.to_otlp(span, root, slow) for root, slow in batch for span in root.trace.spans]
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "questudy.tracing"}, "spans": spans}],
+            }]
+        }
+        response = self._session.post(self.endpoint, json=payload, timeout=5)
+        response.raise_for_status()
+
+
+def build_exporter() -> TraceExporter:
+    if Config.TRACE_EXPORTER == "otlp":
+        return OtlpExporter(Config.TRACE_OTLP_ENDPOINT, Config.TRACE_SERVICE_NAME, Config.TRACE_QUEUE_SIZE)
+    if Config.TRACE_EXPORTER == "jsonl":
+        return JsonLinesExporter(
+            Config.TRACE_FILE, Config.TRACE_QUEUE_SIZE, Config.TRACE_FILE_MAX_BYTES, Config.TRACE_FILE_BACKUPS
+        )
+    raise ValueError(f"Unknown trace exporter: {Config.TRACE_EXPORTER}")
+
+
+def get_exporter() -> TraceExporter:
+    """Exporter of the current process, its thread is started on first use (and again in a forked worker)"""
+    global _exporter, _exporter_pid
+    with _exporter_lock:
+        if _exporter is None or _exporter_pid != os.getpid():
+            _exporter = build_exporter()
+            _exporter_pid = os.getpid()
+        return _exporter
+
+
+def get_trace_stats() -> dict:
+    return _exporter.stats() if _exporter is not None and _exporter_pid == os.getpid() else {}
@@ -4,6 +4,7 @@ import { ArrowLeft, Upload, Trash2, Crown } from 'lucide-react';
 import axios from 'axios';
 import ProfileDropdown from '../components/ProfileDropdown';
 import RankingModal from '../components/RankingModal';
+import { waitForJob } from '../utils/waitForJob';
 
 function CoursePage() {
     const navigate = useNavigate();
@@ -211,6 +212,8 @@ function CoursePage() {
                 console.error('API Error:', apiResponse.data.error);
                 alert(apiResponse.data.error);
             } else {
+                // The questions are generated in the background, wait for the job to finish
+                await waitForJob(apiResponse.data.job_id);
                 navigate('/questions', { 
                     replace: false, 
                     state: { previousPage: window.location.pathname }
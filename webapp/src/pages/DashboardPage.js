@@ -11,22 +11,26 @@ function DashboardPage() {
     const [enrollModalVisible, setEnrollModalVisible] = useState(false);
     const [searchResults, setSearchResults] = useState([]);
     const [searchQuery, setSearchQuery] = useState('');
+    const [nextCursor, setNextCursor] = useState(null);
 
     useEffect(() => {
         fetchCourses();
     }, []);
 
-    const fetchCourses = async () => {
+    // Without a cursor the first page replaces the list, with the cursor of the next page it is appended
+    const fetchCourses = async (cursor = null) => {
         try {
             const response = await axios.get(
                 `${process.env.REACT_APP_API_URL}/api/courses`,
-                { withCredentials: true }
+                { params: cursor ? { cursor } : {}, withCredentials: true }
             );
-            setCourses(response.data.map(course => ({
+            const page = response.data.map(course => ({
                 ...course,
                 isCreator: course.creator_id === sessionStorage.getItem('user_id'),
-                isEnrolled: course.enrolled_users.includes(sessionStorage.getItem('user_id'))
-            })));
+                isEnrolled: course.is_enrolled
+            }));
+            setCourses(previous => cursor ? [...previous, ...page] : page);
+            setNextCursor(response.headers['x-next-cursor'] || null);
         } catch (error) {
             console.error('Failed to fetch courses:', error);
         }
@@ -95,8 +99,8 @@ function DashboardPage() {
     const searchCourses = async () => {
         try {
             const response = await axios.get(
-                `${process.env.REACT_APP_API_URL}/api/courses/search?q=${searchQuery}`,
-                { withCredentials: true }
+                `${process.env.REACT_APP_API_URL}/api/courses/search`,
+                { params: { q: searchQuery }, withCredentials: true }
             );
             setSearchResults(response.data);
         } catch (error) {
@@ -201,6 +205,10 @@ function DashboardPage() {
                 ))}
             </div>
 
+            {nextCursor && (
+                <button onClick={() => fetchCourses(nextCursor)}>Load more courses</button>
+            )}
+
             {/* Create Course Modal */}
             {isFormVisible && (
                 <div style={styles.modalOverlay}>
@@ -273,9 +281,9 @@ function DashboardPage() {
                                     </div>
                                     <button 
                                         onClick={() => handleEnroll(course._id)}
-                                        disabled={course.enrolled_users.includes(sessionStorage.getItem('user_id'))}
+                                        disabled={course.is_enrolled}
                                     >
-                                        {course.enrolled_users.includes(sessionStorage.getItem('user_id')) 
+                                        {course.is_enrolled
                                             ? 'Enrolled' 
                                             : 'Enroll'}
                                     </button>
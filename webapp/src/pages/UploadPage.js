@@ -3,11 +3,13 @@ import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { useDropzone } from 'react-dropzone';
 import ProfileDropdown from '../components/ProfileDropdown';
+import { waitForJob } from '../utils/waitForJob';
 
 function UploadPage() {
     const [file, setFile] = useState(null);
     const [isLoading, setIsLoading] = useState(false);
     const [questionCount, setQuestionCount] = useState(2);
+    const [jobProgress, setJobProgress] = useState(0);
     const navigate = useNavigate();
 
     const onDrop = (acceptedFiles) => {
@@ -24,6 +26,7 @@ function UploadPage() {
         }
 
         setIsLoading(true);
+        setJobProgress(0);
 
         const formData = new FormData();
         formData.append('file', file);
@@ -42,6 +45,8 @@ function UploadPage() {
             if (response.data.error) {
                 alert(response.data.error);
             } else {
+                // The questions are generated in the background, wait for the job to finish
+                await waitForJob(response.data.job_id, (job) => setJobProgress(job.progress));
                 navigate('/questions', { 
                     replace: false, 
                     state: { previousPage: window.location.pathname }
@@ -114,7 +119,7 @@ function UploadPage() {
                         </select>
                     </div>
                     <button onClick={handleFileUpload} className="upload-button">
-                        {isLoading ? 'Generating questions...' : 'Generate Questions'}
+                        {isLoading ? `Generating questions... ${Math.round(jobProgress * 100)}%` : 'Generate Questions'}
                     </button>
                 </section>
                 {/* <section className="sample-pdfs">
@@ -0,0 +1,24 @@
+import axios from 'axios';
+
+const POLL_INTERVAL_MS = 1000;
+
+// Poll a background job until it is done, onProgress receives each status update
+export async function waitForJob(jobId, onProgress) {
+    while (true) {
+        const response = await axios.get(
+            `${process.env.REACT_APP_API_URL}/api/jobs/${jobId}`,
+            { withCredentials: true }
+        );
+        const job = response.data;
+        if (onProgress) {
+            onProgress(job);
+        }
+        if (job.status === 'done') {
+            return job;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Processing failed');
+        }
+        await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+    }
+}